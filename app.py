@@ -1,25 +1,72 @@
-import math
-from flask import Flask, render_template, request, jsonify
+import bisect
+import gzip
+import itertools
+import json
+import queue
+from concurrent.futures import ThreadPoolExecutor
+from flask import Flask, Response, g, render_template, request, jsonify, stream_with_context
 from datetime import datetime, timedelta
-import requests
 import hmac
 import hashlib
 import time
 from pytz import timezone
 import time
-import requests
 import hashlib
 import hmac
 import urllib.parse
 import os
 from dotenv import load_dotenv
+import binance_client
+import kline_store
+import metrics
+from price_hub import PriceHub
+from ttl_cache import TTLCache, seconds_to_next_minute
+
+try:
+    import brotli  # Tùy chọn: nén br nếu đã cài gói brotli
+except ImportError:
+    brotli = None
 
 app = Flask(__name__)
 
 API_KEY = os.getenv("API_KEY")
 API_SECRET = os.getenv("API_SECRET")
-# BASE_URL = 'https://testnet.binance.vision/api/v3'  # Dùng testnet cho các lệnh cần xác thực
-BASE_URL = 'https://api.binance.com/api/v3'  # Dùng testnet cho các lệnh cần xác thực
+# BASE_URL cấu hình trong binance_client (biến môi trường BINANCE_BASE_URL)
+
+# Số ngày tối đa cho /get_historical_data
+MAX_HISTORY_DAYS = int(os.getenv('MAX_HISTORY_DAYS', 365))
+
+# Nén response từ kích thước này trở lên (byte)
+COMPRESS_MIN_SIZE = 1024
+COMPRESSIBLE_MIMETYPES = ('application/json', 'application/octet-stream')
+
+# Cache giá theo (endpoint, symbol): request trùng trong TTL dùng chung một lần gọi Binance
+TICKER_CACHE_TTL = float(os.getenv('TICKER_CACHE_TTL', 1.0))
+KLINES_CACHE_TTL = float(os.getenv('KLINES_CACHE_TTL')) if os.getenv('KLINES_CACHE_TTL') else None
+price_cache = TTLCache(max_size=int(os.getenv('PRICE_CACHE_SIZE', 1024)))
+
+# Route batch: số symbol tối đa mỗi request và số luồng lấy nến song song
+MAX_BATCH_SYMBOLS = int(os.getenv('MAX_BATCH_SYMBOLS', 100))
+BATCH_CONCURRENCY = int(os.getenv('BATCH_CONCURRENCY', 10))
+# Mã lỗi Binance "Invalid symbol."
+INVALID_SYMBOL_CODE = -1121
+
+# Một poller giá cho mỗi symbol, dùng chung cho mọi trình duyệt đang xem
+price_hub = PriceHub(interval=1.0, fetch=lambda symbol: get_cached_price(symbol))
+
+ROUTE_LATENCY = metrics.histogram('http_request_duration_seconds', 'Flask route latency until the response is returned', ('route', 'method', 'status'))
+CACHE_LOOKUPS = metrics.counter('cache_lookups_total', 'Cache lookups by result', ('cache', 'result'))
+CACHE_HIT_RATIO = metrics.gauge('cache_hit_ratio', 'Share of lookups served without a new upstream call', ('cache',))
+CACHE_SIZE = metrics.gauge('cache_entries', 'Entries currently held in the cache', ('cache',))
+
+def collect_cache_metrics():
+	stats = price_cache.stats()
+	for result in ('hits', 'misses', 'coalesced'):
+		CACHE_LOOKUPS.set(stats[result], cache='price', result=result)
+	CACHE_HIT_RATIO.set(stats['hit_ratio'], cache='price')
+	CACHE_SIZE.set(stats['size'], cache='price')
+
+metrics.REGISTRY.add_collector(collect_cache_metrics)
 
 def create_signature(params):
 	# Sắp xếp tham số theo thứ tự từ A-Z và mã hóa thành chuỗi truy vấn
@@ -34,31 +81,113 @@ def create_signature(params):
 def index():
 	return render_template('index.html')
 
+def load_recent_klines(symbol):
+	# Gọi API Binance để lấy 60 cây nến 1 phút gần nhất
+	response = binance_client.get(
+		'/klines',
+		params={
+			'symbol': symbol,
+			'interval': '1m',
+			'limit': 60
+		}
+	)
+	
+	klines = response.json()
+	
+	if not klines:
+		return {'error': 'No data available'}
+	
+	return {
+		'timestamps': [kline[0] for kline in klines],
+		'close': [float(kline[4]) for kline in klines]
+	}
+
+def load_current_price(symbol):
+	response = binance_client.get('/ticker/price', params={'symbol': symbol})
+	data = response.json()
+
+	if 'price' not in data:
+		return {'error': 'No data available'}
+
+	return {
+		'timestamp': int(datetime.now().timestamp() * 1000),
+		'close': float(data['price'])
+	}
+
+def load_current_prices(symbols):
+	# Một request /ticker/price?symbols=[...] cho mọi symbol, thay vì một request mỗi symbol
+	response = binance_client.get('/ticker/price', params={'symbols': json.dumps(symbols, separators=(',', ':'))})
+	data = response.json()
+
+	if response.status_code == 400 and isinstance(data, dict) and data.get('code') == INVALID_SYMBOL_CODE:
+		# Binance từ chối cả lô nếu có một symbol không hợp lệ: lấy riêng từng symbol để chỉ symbol đó báo lỗi
+		return map_concurrently(load_current_price, symbols)
+	if not isinstance(data, list):
+		# 429/418, 5xx...: ném lỗi (không lưu vào cache) thay vì gửi thêm một request cho mỗi symbol
+		response.raise_for_status()
+		raise ValueError(data.get('msg', 'No data available') if isinstance(data, dict) else 'No data available')
+
+	timestamp = int(datetime.now().timestamp() * 1000)
+	prices = {item['symbol']: float(item['price']) for item in data}
+	return {
+		symbol: {'timestamp': timestamp, 'close': prices[symbol]} if symbol in prices else {'error': 'No data available'}
+		for symbol in symbols
+	}
+
+def map_concurrently(fn, symbols):
+	# {symbol: fn(symbol)}, chạy song song tối đa BATCH_CONCURRENCY luồng
+	with ThreadPoolExecutor(max_workers=max(1, min(BATCH_CONCURRENCY, len(symbols)))) as executor:
+		return dict(zip(symbols, executor.map(fn, symbols)))
+
+def parse_symbols(data):
+	# 'symbols' là danh sách hoặc chuỗi phân tách bằng dấu phẩy; bỏ trùng, giữ thứ tự
+	symbols = data.get('symbols') or []
+	if isinstance(symbols, str):
+		symbols = symbols.split(',')
+	symbols = list(dict.fromkeys(str(symbol).strip().upper() for symbol in symbols if str(symbol).strip()))
+	if not symbols:
+		raise ValueError('symbols is required')
+	if len(symbols) > MAX_BATCH_SYMBOLS:
+		raise ValueError(f"at most {MAX_BATCH_SYMBOLS} symbols per request")
+	return symbols
+
+def klines_since(prices, since):
+	# Các nến mới hoặc vừa cập nhật kể từ since (timestamps đã sắp xếp tăng dần)
+	start = bisect.bisect_left(prices['timestamps'], since)
+	return {
+		'timestamps': prices['timestamps'][start:],
+		'close': prices['close'][start:]
+	}
+
+def klines_cache_ttl():
+	# Mặc định giữ nến 1 phút đến mốc phút tiếp theo
+	return KLINES_CACHE_TTL if KLINES_CACHE_TTL is not None else seconds_to_next_minute()
+
+def get_recent_klines(symbol):
+	return price_cache.get_or_load(('klines_1m', symbol), lambda: load_recent_klines(symbol), klines_cache_ttl)
+
+def get_cached_price(symbol):
+	return price_cache.get_or_load(('ticker', symbol), lambda: load_current_price(symbol), TICKER_CACHE_TTL)
+
+def get_cached_prices(symbols):
+	# Dùng chung cache với get_cached_price: chỉ các symbol chưa có hoặc hết hạn được gộp vào một request
+	def load(keys):
+		prices = load_current_prices([symbol for _, symbol in keys])
+		return {('ticker', symbol): price for symbol, price in prices.items()}
+
+	prices = price_cache.get_or_load_many([('ticker', symbol) for symbol in symbols], load, TICKER_CACHE_TTL)
+	return {symbol: price for (_, symbol), price in prices.items()}
+
 @app.route('/get_price', methods=['POST'])
 def get_price():
 	symbol = request.json.get('symbol', 'BTCUSDT').upper()
+	# since (open_time, ms): chỉ trả về các nến có open_time >= since, gồm cả nến đang chạy
+	since = request.json.get('since')
 	try:
-		# Gọi API Binance để lấy 60 cây nến 1 phút gần nhất
-		response = requests.get(
-			f'{BASE_URL}/klines',
-			params={
-				'symbol': symbol,
-				'interval': '1m',
-				'limit': 60
-			}
-		)
-		
-		klines = response.json()
-		
-		if not klines:
-			return jsonify({'error': 'No data available'})
-		
-		prices = {
-			'timestamps': [kline[0] for kline in klines],
-			'close': [float(kline[4]) for kline in klines]
-		}
+		prices = get_recent_klines(symbol)
+		if since is not None and 'error' not in prices:
+			prices = klines_since(prices, int(since))
 		return jsonify(prices)
-		
 	except Exception as e:
 		return jsonify({'error': str(e)})
 
@@ -66,21 +195,71 @@ def get_price():
 def get_current_price():
 	symbol = request.json.get('symbol', 'BTCUSDT').upper()
 	try:
-		response = requests.get(f'https://api.binance.com/api/v3/ticker/price?symbol={symbol}')
-		data = response.json()
+		return jsonify(get_cached_price(symbol))
+	except Exception as e:
+		return jsonify({'error': str(e)})
 
-		if 'price' not in data:
-			return jsonify({'error': 'No data available'})
+@app.route('/get_prices', methods=['POST'])
+def get_prices():
+	# Nến 1 phút của nhiều symbol trong một response {symbol: {...}}; since là số (ms) hoặc {symbol: ms}
+	try:
+		symbols = parse_symbols(request.json)
+	except ValueError as e:
+		return jsonify({'error': str(e)}), 400
+	since = request.json.get('since')
 
-		prices = {
-			'timestamp': int(datetime.now().timestamp() * 1000),
-			'close': float(data['price'])
-		}
-		return jsonify(prices)
-		
+	def load(symbol):
+		try:
+			prices = get_recent_klines(symbol)
+			symbol_since = since.get(symbol) if isinstance(since, dict) else since
+			if symbol_since is not None and 'error' not in prices:
+				prices = klines_since(prices, int(symbol_since))
+			return prices
+		except Exception as e:
+			return {'error': str(e)}
+
+	return jsonify(map_concurrently(load, symbols))
+
+@app.route('/get_current_prices', methods=['POST'])
+def get_current_prices():
+	try:
+		symbols = parse_symbols(request.json)
+	except ValueError as e:
+		return jsonify({'error': str(e)}), 400
+	try:
+		return jsonify(get_cached_prices(symbols))
 	except Exception as e:
 		return jsonify({'error': str(e)})
 
+@app.route('/cache_stats')
+def cache_stats():
+	return jsonify(price_cache.stats())
+
+@app.route('/metrics')
+def metrics_endpoint():
+	return Response(metrics.REGISTRY.render(), content_type=metrics.CONTENT_TYPE)
+
+@app.route('/price_stream')
+def price_stream():
+	symbol = request.args.get('symbol', 'BTCUSDT').upper()
+
+	def generate():
+		subscriber = price_hub.subscribe(symbol)
+		try:
+			while True:
+				try:
+					data = subscriber.get(timeout=15)
+				except queue.Empty:
+					# Comment SSE để giữ kết nối qua proxy khi không có giá mới
+					yield ': keep-alive\n\n'
+					continue
+				yield f"data: {json.dumps(data)}\n\n"
+		finally:
+			price_hub.unsubscribe(symbol, subscriber)
+
+	headers = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+	return Response(stream_with_context(generate()), mimetype='text/event-stream', headers=headers)
+
 @app.route('/place_order', methods=['POST'])
 def place_order():
 	data = request.json
@@ -105,7 +284,7 @@ def place_order():
 		headers = {'X-MBX-APIKEY': API_KEY}
 
 		# Gửi yêu cầu POST đến API Binance
-		response = requests.post(f"{BASE_URL}/order", headers=headers, params=params)
+		response = binance_client.post('/order', headers=headers, params=params)
 
 		# Trả về kết quả phản hồi từ Binance API
 		return jsonify(response.json())
@@ -128,7 +307,7 @@ def get_orders():
 		params['signature'] = create_signature(params)
 
 		headers = {'X-MBX-APIKEY': API_KEY}
-		response = requests.get(f"{BASE_URL}/allOrders", headers=headers, params=params)
+		response = binance_client.get('/allOrders', headers=headers, params=params)
 		
 		return jsonify(response.json())
 	except Exception as e:
@@ -139,6 +318,23 @@ def get_historical_data():
     try:
         symbol = request.json.get('symbol', '').upper()
         days = int(request.json.get('days', 5))  # days bây giờ sẽ là tổng số ngày luôn
+        stream = bool(request.json.get('stream', False))
+        # Định dạng trả về: 'rows' (mặc định), 'columnar' (JSON dạng cột) hoặc 'binary' (float64)
+        output_format = request.json.get('format', 'rows')
+        # Chỉ lấy các nến đã đóng: dữ liệu không đổi nên hỗ trợ ETag/If-None-Match
+        closed_only = bool(request.json.get('closed_only', False))
+        # Số điểm tối đa trả về (0 = không giảm mẫu), gộp nến theo nhóm giữ nguyên cao/thấp
+        max_points = int(request.json.get('max_points', 0))
+
+        # Giới hạn số ngày phía server để tránh request quá lớn
+        if days < 1 or days > MAX_HISTORY_DAYS:
+            return jsonify({'error': f"days must be between 1 and {MAX_HISTORY_DAYS}"}), 400
+        if output_format not in CANDLE_FORMATS:
+            return jsonify({'error': f"format must be one of {', '.join(CANDLE_FORMATS)}"}), 400
+        if max_points < 0 or (max_points and stream):
+            return jsonify({'error': "max_points must be positive and cannot be combined with stream"}), 400
+        if stream and output_format == 'columnar':
+            return jsonify({'error': "stream is not supported for columnar format"}), 400
 
         # Đặt múi giờ UTC
         utc_tz = timezone('UTC')
@@ -148,72 +344,121 @@ def get_historical_data():
         
         # Thời điểm bắt đầu (n-1 ngày trước, tính từ đầu ngày)
         start_time = current_time_utc.replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(days=days-1)
-        
-        # Số ngày trong mỗi chunk
-        days_per_chunk = 3
-        
-        # Tính số chunks cần thiết
-        num_chunks = math.ceil(days / days_per_chunk)
-        
-        all_data = []
-        
-        # Lặp qua từng chunk để lấy dữ liệu
-        for i in range(num_chunks):
-            if i == 0:
-                # Chunk đầu tiên lấy đến thời điểm hiện tại
-                chunk_end = current_time_utc
-            else:
-                # Các chunk khác lấy đến cuối ngày
-                days_back = i * days_per_chunk
-                chunk_end = current_time_utc.replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(days=days_back-1)
-            
-            # Tính thời điểm bắt đầu của chunk
-            if i == num_chunks - 1:
-                # Chunk cuối cùng bắt đầu từ start_time
-                chunk_start = start_time
-            else:
-                chunk_start = chunk_end - timedelta(days=days_per_chunk)
-
-            params = {
-                'symbol': symbol,
-                'interval': '5m',
-                'startTime': int(chunk_start.timestamp() * 1000),
-                'endTime': int(chunk_end.timestamp() * 1000),
-                'limit': 1000
-            }
-            
-            # print(f"Chunk {i + 1}/{num_chunks}:")
-            # print(f"Start: {chunk_start}")
-            # print(f"End: {chunk_end}")
-            # print("Params:", params)
-            # print("---")
-
-            # Gửi yêu cầu GET đến Binance API
-            response = requests.get(f"{BASE_URL}/klines", params=params)
-            klines = response.json()
-
-            # Format dữ liệu cho chunk hiện tại
-            for kline in klines:
-                try:
-                    open_time = datetime.fromtimestamp(int(float(kline[0])) / 1000, tz=utc_tz)
-                except ValueError:
-                    return jsonify({'error': f"Invalid data format in kline: {kline[0]}"})
-
-                formatted_time = open_time.strftime('%d.%m.%y - %H:%M')
-                formatted_kline = [formatted_time] + kline[1:]
-                all_data.append(formatted_kline)
-
-            # Thêm một khoảng delay nhỏ giữa các request
-            if i < num_chunks - 1:
-                time.sleep(0.1)
-
-        # Sắp xếp lại dữ liệu theo thời gian
-        all_data.sort(key=lambda x: datetime.strptime(x[0], '%d.%m.%y - %H:%M'))
-
-        return jsonify(all_data)
+        start_ms = int(start_time.timestamp() * 1000)
+        end_ms = int(current_time_utc.timestamp() * 1000)
+
+        etag = None
+        if closed_only:
+            # Bỏ nến đang chạy: end_ms lùi về trước thời điểm mở của nến hiện tại
+            step = kline_store.INTERVAL_MS['5m']
+            end_ms = end_ms // step * step - 1
+            etag = hashlib.md5(f"{symbol}:5m:{start_ms}:{end_ms}:{output_format}:{max_points}".encode()).hexdigest()
+            # ETag yếu: cùng một dữ liệu có thể được gửi dạng gốc, gzip hoặc br (compress_response)
+            if request.if_none_match.contains_weak(etag):
+                return Response(status=304, headers={'ETag': f'W/"{etag}"'})
+
+        if stream:
+            response = stream_historical_data(symbol, start_ms, end_ms, output_format)
+        else:
+            # Lấy nến từ kline_store: chỉ tải từ Binance các khoảng chưa có và nến đang chạy
+            candles = kline_store.get_candles(symbol, '5m', start_ms, end_ms)
+            if max_points:
+                candles = candles.downsample(max_points)
+
+            # Chỉ định dạng dữ liệu ở bước trả kết quả
+            response = encode_candles(candles, output_format)
+
+        if etag is not None:
+            response.set_etag(etag, weak=True)
+        return response
 
     except Exception as e:
         return jsonify({'error': str(e)})
 
+CANDLE_FORMATS = ('rows', 'columnar', 'binary')
+
+def encode_candles(candles, output_format):
+    if output_format == 'binary':
+        return Response(candles.to_bytes(), mimetype='application/octet-stream')
+    if output_format == 'columnar':
+        return jsonify(candles.to_columns())
+    # Mặc định: bố cục 12 cột của Binance như trước, cột đầu là thời gian đã định dạng
+    return jsonify(candles.to_rows())
+
+def stream_historical_data(symbol, start_ms, end_ms, output_format):
+    # Gửi dữ liệu theo từng trang nến ngay khi trang đó sẵn sàng (chunked transfer), chỉ 'rows' và 'binary'
+    pages = kline_store.iter_candles(symbol, '5m', start_ms, end_ms)
+
+    # Lấy trang đầu trước khi trả Response để lỗi (sai symbol, ...) vẫn trả về JSON lỗi như bình thường
+    first_page = next(pages, None)
+    all_pages = itertools.chain([first_page] if first_page is not None else [], pages)
+
+    # Lỗi ở trang sau: status 200 đã gửi nên chỉ còn cách ném lại lỗi để server cắt kết nối
+    # (thiếu chunk kết thúc); không đóng mảng ']' để client không nhận nhầm dữ liệu thiếu là đầy đủ
+    def generate_rows():
+        yield '['
+        is_first = True
+        try:
+            for candles in all_pages:
+                if not len(candles):
+                    continue
+                body = json.dumps(candles.to_rows())[1:-1]
+                yield body if is_first else ',' + body
+                is_first = False
+        except Exception as e:
+            print(f"Lỗi khi stream dữ liệu {symbol}: {e}")
+            raise
+        yield ']'
+
+    def generate_binary():
+        # Định dạng nhị phân theo hàng nên các trang nối tiếp nhau trực tiếp
+        try:
+            for candles in all_pages:
+                yield candles.to_bytes()
+        except Exception as e:
+            print(f"Lỗi khi stream dữ liệu {symbol}: {e}")
+            raise
+
+    if output_format == 'binary':
+        return Response(stream_with_context(generate_binary()), mimetype='application/octet-stream')
+    return Response(stream_with_context(generate_rows()), mimetype='application/json')
+
+@app.before_request
+def start_request_timer():
+	g.request_started = time.perf_counter()
+
+@app.after_request
+def record_request_latency(response):
+	# Response dạng stream chỉ được tính đến lúc trả header; rule (không phải path) để số nhãn không tăng theo symbol
+	started = g.pop('request_started', None)
+	if started is not None:
+		route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+		ROUTE_LATENCY.observe(time.perf_counter() - started, route=route, method=request.method, status=response.status_code)
+	return response
+
+@app.after_request
+def compress_response(response):
+    # Nén gzip/br cho các response lớn (bỏ qua response dạng stream và SSE)
+    if (response.is_streamed or response.direct_passthrough or response.status_code != 200
+            or 'Content-Encoding' in response.headers
+            or response.mimetype not in COMPRESSIBLE_MIMETYPES):
+        return response
+
+    data = response.get_data()
+    if len(data) < COMPRESS_MIN_SIZE:
+        return response
+
+    if brotli is not None and 'br' in request.accept_encodings:
+        response.set_data(brotli.compress(data, quality=5))
+        response.headers['Content-Encoding'] = 'br'
+    elif 'gzip' in request.accept_encodings:
+        response.set_data(gzip.compress(data, compresslevel=5))
+        response.headers['Content-Encoding'] = 'gzip'
+    else:
+        return response
+
+    response.vary.add('Accept-Encoding')
+    return response
+
 if __name__ == '__main__':
 	app.run(debug=True)
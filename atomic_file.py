@@ -0,0 +1,19 @@
+import os
+import tempfile
+
+def atomic_write(path, text, prefix='.tmp-'):
+    """
+    Replace path with text: write a temp file in the same directory, then
+    os.replace() it over path, so readers never see a half-written file.
+    The temp file is removed if anything fails.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=prefix, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(text)
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
@@ -0,0 +1,427 @@
+"""
+Benchmarks for the scanner, historical data and Flask routes, run against
+the local fake Binance server (bench/fake_binance.py).
+
+    python bench/bench.py scan --symbols 10 100 500 2000 --ticks 3
+    python bench/bench.py history --days 1 30 365
+    python bench/bench.py routes --clients 1 10 50 --requests 100
+    python bench/bench.py market --market 2000 --top 10 50
+    python bench/bench.py stream --streams 10 100
+    python bench/bench.py all --json results.json --baseline baseline.json
+
+Each result reports latency percentiles, operations per second, upstream
+calls per operation and peak memory. --json saves the results and
+--baseline prints the change against a previous run. The stream suite
+also checks the SUBSCRIBE/UNSUBSCRIBE requests the bot sends after /add
+and /remove and fails if they are wrong.
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import queue
+import random
+import resource
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from fake_binance import FakeBinance, FakeKlineStream, load_recorded, market_symbols
+
+def percentile(values, fraction):
+    # Nearest-rank, đủ chính xác cho báo cáo benchmark
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(fraction * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+def max_rss_mb():
+    # ru_maxrss là KB trên Linux, byte trên macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == 'darwin' else rss / 1024
+
+class Recorder:
+    """
+    Collects latencies of one scenario together with the fake server's
+    call count and the memory peak over the same window.
+    """
+
+    def __init__(self, fake, trace_memory):
+        self.fake = fake
+        self.trace_memory = trace_memory
+        self.latencies = []
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        self.fake.reset_counters()
+        if self.trace_memory:
+            tracemalloc.start()
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.elapsed = time.perf_counter() - self.started
+        self.upstream_calls = self.fake.total_calls()
+        self.upstream_by_endpoint = dict(self.fake.calls)
+        self.rate_limited = self.fake.rate_limited
+        if self.trace_memory:
+            self.peak_memory_mb = tracemalloc.get_traced_memory()[1] / (1024 * 1024)
+            tracemalloc.stop()
+        else:
+            self.peak_memory_mb = max_rss_mb()
+
+    def time(self, fn, *args, **kwargs):
+        started = time.perf_counter()
+        result = fn(*args, **kwargs)
+        with self._lock:
+            self.latencies.append(time.perf_counter() - started)
+        return result
+
+    def result(self, scenario, **params):
+        operations = len(self.latencies)
+        return {
+            'scenario': scenario,
+            'params': params,
+            'operations': operations,
+            'p50_ms': percentile(self.latencies, 0.50) * 1000,
+            'p90_ms': percentile(self.latencies, 0.90) * 1000,
+            'p99_ms': percentile(self.latencies, 0.99) * 1000,
+            'max_ms': max(self.latencies, default=0.0) * 1000,
+            'ops_per_sec': operations / self.elapsed if self.elapsed else 0.0,
+            'upstream_calls': self.upstream_calls,
+            'upstream_per_op': self.upstream_calls / operations if operations else 0.0,
+            'upstream_by_endpoint': self.upstream_by_endpoint,
+            'rate_limited': self.rate_limited,
+            'peak_memory_mb': self.peak_memory_mb,
+            'memory_source': 'tracemalloc' if self.trace_memory else 'max_rss'
+        }
+
+class StubOutbox:
+    # Thay TelegramOutbox: đếm tin nhắn thay vì gửi lên Telegram
+    def __init__(self):
+        self.sent = 0
+
+    def send(self, chat_id, text, parse_mode=None, reply_to_message_id=None):
+        self.sent += 1
+
+    def reply_to(self, message, text, parse_mode=None):
+        self.sent += 1
+
+    def pending(self):
+        return 0
+
+def configure_environment(fake, workdir, args):
+    # Phải chạy trước khi import binance_client/bot/app vì cấu hình được đọc lúc import
+    os.environ['BINANCE_BASE_URL'] = fake.base_url
+    os.environ['KLINE_DB_FILE'] = os.path.join(workdir, 'klines.db')
+    os.environ['BINANCE_WEIGHT_LIMIT'] = str(args.client_weight_limit)
+    os.environ['BOT_TOKEN'] = os.environ.get('BOT_TOKEN') or '0:bench'
+    os.environ['BOT_METRICS_PORT'] = '0'
+    os.environ['API_KEY'] = os.environ.get('API_KEY') or 'bench'
+    os.environ['API_SECRET'] = os.environ.get('API_SECRET') or 'bench'
+    os.chdir(workdir)
+
+def bench_scan(fake, args):
+    import bot
+    from chat_registry import ChatRegistry
+
+    bot.outbox = StubOutbox()
+    results = []
+    for count in args.symbols:
+        symbols = [f'SYM{index:04d}USDT' for index in range(count)]
+
+        # Trạng thái sạch cho mỗi cỡ danh sách: registry riêng, tracker rỗng
+        state_dir = tempfile.mkdtemp(prefix=f'scan-{count}-', dir=os.getcwd())
+        bot.chat_registry = ChatRegistry(os.path.join(state_dir, 'chats.json'), os.path.join(state_dir, 'checklists'))
+        bot.intraday_tracker.reset()
+        for chat_id in range(args.chats):
+            bot.get_watchlist(chat_id + 1).add(symbols)
+
+        # Bot in từng symbol ra stdout; bỏ phần in đó để không làm lệch thời gian đo
+        with Recorder(fake, args.trace_memory) as cold, contextlib.redirect_stdout(io.StringIO()):
+            cold.time(bot.check_coin_limits)
+        results.append(cold.result('scan_cold', symbols=count, chats=args.chats))
+
+        with Recorder(fake, args.trace_memory) as warm, contextlib.redirect_stdout(io.StringIO()):
+            for _ in range(args.ticks):
+                warm.time(bot.check_coin_limits)
+        results.append(warm.result('scan_warm', symbols=count, chats=args.chats))
+    return results
+
+def bench_history(fake, args):
+    import bot
+
+    results = []
+    for days in args.days:
+        # Lần đầu: kho nến trống (symbol mới mỗi lần); lần sau: cùng symbol, chỉ thiếu nến mới nhất
+        with Recorder(fake, args.trace_memory) as cold:
+            for repeat in range(args.repeat):
+                cold.time(bot.get_historical_data, f'HIST{days:03d}X{repeat:02d}USDT', days)
+        results.append(cold.result('history_cold', days=days))
+
+        with Recorder(fake, args.trace_memory) as warm:
+            for repeat in range(args.repeat):
+                warm.time(bot.get_historical_data, f'HIST{days:03d}X{repeat:02d}USDT', days)
+        results.append(warm.result('history_warm', days=days))
+    return results
+
+def bench_market(fake, args):
+    import market_scanner
+
+    results = []
+    for top_k in args.top:
+        # Lần đầu fake server còn phải tính ticker 24h cho cả thị trường, không tính vào kết quả
+        market_scanner.scan_market(top_k)
+        with Recorder(fake, args.trace_memory) as recorder:
+            for _ in range(args.repeat):
+                recorder.time(market_scanner.scan_market, top_k)
+        results.append(recorder.result('market_scan', pairs=args.market, top=top_k))
+    return results
+
+def wait_until(predicate, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.005)
+    return True
+
+def bench_stream(fake, args):
+    import bot
+    from chat_registry import ChatRegistry
+    from kline_stream import KlineStream
+
+    stream = FakeKlineStream().start()
+    results = []
+    try:
+        for count in args.streams:
+            symbols = [f'WS{count:04d}X{index:04d}USDT' for index in range(count)]
+            extra = [f'WS{count:04d}ADD{index:03d}USDT' for index in range(args.repeat)]
+
+            # Registry riêng như bot thật: /add, /remove -> on_watchlist_changed -> update_symbols
+            state_dir = tempfile.mkdtemp(prefix=f'stream-{count}-', dir=os.getcwd())
+            bot.chat_registry = ChatRegistry(
+                os.path.join(state_dir, 'chats.json'), os.path.join(state_dir, 'checklists'),
+                on_change=bot.on_watchlist_changed
+            )
+            closed = queue.Queue()
+            client = KlineStream([], lambda symbol, kline: closed.put((symbol, kline)), interval='5m', url=stream.url)
+            bot.kline_stream_client = client
+            try:
+                with contextlib.redirect_stdout(io.StringIO()):
+                    client.start()
+                    watchlist = bot.get_watchlist(1)
+                    watchlist.add(symbols)
+                    expected = {f'{symbol.lower()}@kline_5m' for symbol in symbols}
+                    if not wait_until(lambda: stream.subscribed() == expected):
+                        raise RuntimeError(f"kline stream không đăng ký đủ {count} stream khi kết nối")
+
+                    def subscribe(symbol):
+                        seen = len(stream.requests)
+                        watchlist.add([symbol])
+                        if not wait_until(lambda: len(stream.requests) > seen):
+                            raise RuntimeError(f"/add {symbol} không gửi SUBSCRIBE")
+                        request = stream.requests[seen]
+                        if request['method'] != 'SUBSCRIBE' or request['params'] != [f'{symbol.lower()}@kline_5m']:
+                            raise RuntimeError(f"/add {symbol} gửi sai: {request}")
+
+                    def unsubscribe(symbol):
+                        seen = len(stream.requests)
+                        watchlist.remove([symbol])
+                        if not wait_until(lambda: len(stream.requests) > seen):
+                            raise RuntimeError(f"/remove {symbol} không gửi UNSUBSCRIBE")
+                        request = stream.requests[seen]
+                        if request['method'] != 'UNSUBSCRIBE' or request['params'] != [f'{symbol.lower()}@kline_5m']:
+                            raise RuntimeError(f"/remove {symbol} gửi sai: {request}")
+
+                    def deliver(symbol):
+                        # Nến chưa đóng phải bị bỏ qua, nến đã đóng tới callback với đúng symbol
+                        stream.push_kline(symbol, closed=False)
+                        if not stream.push_kline(symbol):
+                            raise RuntimeError(f"{symbol} không có kết nối nào đăng ký")
+                        received, kline = closed.get(timeout=5)
+                        if received != symbol or len(kline) != 12:
+                            raise RuntimeError(f"nến sai cho {symbol}: {received} {kline}")
+
+                    with Recorder(fake, args.trace_memory) as recorder:
+                        for symbol in extra:
+                            recorder.time(subscribe, symbol)
+                    results.append(recorder.result('stream_subscribe', streams=count))
+
+                    with Recorder(fake, args.trace_memory) as recorder:
+                        for symbol in symbols + extra:
+                            recorder.time(deliver, symbol)
+                    results.append(recorder.result('stream_kline', streams=count))
+
+                    with Recorder(fake, args.trace_memory) as recorder:
+                        for symbol in extra:
+                            recorder.time(unsubscribe, symbol)
+                    results.append(recorder.result('stream_unsubscribe', streams=count))
+
+                    if stream.subscribed() != expected:
+                        raise RuntimeError("sau /remove stream còn đăng ký khác danh sách")
+                    if not closed.empty():
+                        raise RuntimeError("nến chưa đóng đã được chuyển tới callback")
+            finally:
+                bot.kline_stream_client = None
+                client.stop()
+    finally:
+        stream.stop()
+    return results
+
+def batch_symbols(symbol, size=20):
+    # Danh sách như một dashboard theo dõi: ROUTEnnnUSDT được chọn và các symbol kế tiếp
+    index = int(symbol[5:8])
+    return [f'ROUTE{(index + offset) % 1000:03d}USDT' for offset in range(size)]
+
+ROUTE_REQUESTS = {
+    'get_price': lambda symbol: ('/get_price', {'symbol': symbol}),
+    'get_current_price': lambda symbol: ('/get_current_price', {'symbol': symbol}),
+    'get_historical_data': lambda symbol: ('/get_historical_data', {'symbol': symbol, 'days': 7, 'format': 'binary'}),
+    'get_prices': lambda symbol: ('/get_prices', {'symbols': batch_symbols(symbol)}),
+    'get_current_prices': lambda symbol: ('/get_current_prices', {'symbols': batch_symbols(symbol)}),
+    'get_orders': lambda symbol: ('/get_orders', {'symbol': symbol}),
+    'place_order': lambda symbol: ('/place_order', {'symbol': symbol, 'side': 'BUY', 'quantity': 1}),
+}
+
+def bench_routes(fake, args):
+    import requests
+    from werkzeug.serving import WSGIRequestHandler, make_server
+    import app
+
+    class QuietHandler(WSGIRequestHandler):
+        def log_request(self, *args, **kwargs):
+            pass
+
+    server = make_server('127.0.0.1', 0, app.app, threaded=True, request_handler=QuietHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f'http://127.0.0.1:{server.server_port}'
+    symbols = [f'ROUTE{index:03d}USDT' for index in range(args.route_symbols)]
+
+    results = []
+    try:
+        for clients in args.clients:
+            recorders = {route: Recorder(fake, False) for route in args.routes}
+            errors = []
+
+            def client(seed):
+                rng = random.Random(seed)
+                session = requests.Session()
+                for _ in range(args.requests):
+                    route = rng.choice(args.routes)
+                    path, payload = ROUTE_REQUESTS[route](rng.choice(symbols))
+                    try:
+                        response = recorders[route].time(session.post, base_url + path, json=payload, timeout=60)
+                        response.content
+                        if response.status_code >= 500:
+                            errors.append(response.status_code)
+                    except Exception as e:
+                        errors.append(str(e))
+
+            with Recorder(fake, args.trace_memory) as total:
+                threads = [threading.Thread(target=client, args=(seed,)) for seed in range(clients)]
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+                total.latencies = [latency for recorder in recorders.values() for latency in recorder.latencies]
+
+            for route, recorder in recorders.items():
+                if not recorder.latencies:
+                    continue
+                # Các route chạy xen kẽ nên chỉ tính được tổng lượt gọi upstream, không tách theo route
+                recorder.elapsed = total.elapsed
+                recorder.upstream_calls = 0
+                recorder.upstream_by_endpoint = {}
+                recorder.rate_limited = 0
+                recorder.peak_memory_mb = total.peak_memory_mb
+                results.append(recorder.result(f'route:{route}', clients=clients))
+            result = total.result('routes_total', clients=clients)
+            result['errors'] = len(errors)
+            results.append(result)
+    finally:
+        server.shutdown()
+    return results
+
+def describe(result):
+    params = ' '.join(f'{key}={value}' for key, value in result['params'].items())
+    return f"{result['scenario']} {params}".strip()
+
+def print_results(results, baseline=None):
+    baseline_by_key = {describe(result): result for result in baseline or []}
+    header = f"{'scenario':<40} {'ops':>6} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9} {'ops/s':>9} {'up/op':>7} {'429':>5} {'mem MB':>8}"
+    print(header)
+    print('-' * len(header))
+    for result in results:
+        line = (f"{describe(result):<40} {result['operations']:>6} {result['p50_ms']:>9.1f} {result['p90_ms']:>9.1f} "
+                f"{result['p99_ms']:>9.1f} {result['ops_per_sec']:>9.1f} {result['upstream_per_op']:>7.1f} "
+                f"{result['rate_limited']:>5} {result['peak_memory_mb']:>8.1f}")
+        previous = baseline_by_key.get(describe(result))
+        if previous is not None and previous['p50_ms'] and previous['ops_per_sec']:
+            line += (f"   p50 {(result['p50_ms'] / previous['p50_ms'] - 1) * 100:+.0f}%"
+                     f" ops/s {(result['ops_per_sec'] / previous['ops_per_sec'] - 1) * 100:+.0f}%")
+        print(line)
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark against a local fake Binance server.')
+    parser.add_argument('suite', choices=('scan', 'history', 'routes', 'market', 'stream', 'all'))
+    parser.add_argument('--symbols', type=int, nargs='+', default=[10, 100, 500, 2000], help='số symbol cho scan')
+    parser.add_argument('--chats', type=int, default=1, help='số chat cùng theo dõi danh sách (scan)')
+    parser.add_argument('--ticks', type=int, default=3, help='số lượt quét sau lượt đầu (scan)')
+    parser.add_argument('--days', type=int, nargs='+', default=[1, 30, 365], help='số ngày cho history')
+    parser.add_argument('--repeat', type=int, default=3, help='số lần lặp mỗi cấu hình history')
+    parser.add_argument('--clients', type=int, nargs='+', default=[1, 10, 50], help='số client đồng thời (routes)')
+    parser.add_argument('--requests', type=int, default=50, help='số request mỗi client (routes)')
+    parser.add_argument('--routes', nargs='+', choices=sorted(ROUTE_REQUESTS), default=['get_price', 'get_current_price', 'get_historical_data'])
+    parser.add_argument('--market', type=int, default=2000, help='số cặp USDT của thị trường giả (market)')
+    parser.add_argument('--top', type=int, nargs='+', default=[10, 50], help='số symbol /scan trả về (market)')
+    parser.add_argument('--streams', type=int, nargs='+', default=[10, 100], help='số stream đăng ký sẵn (stream)')
+    parser.add_argument('--route-symbols', type=int, default=20, help='số symbol khác nhau client hỏi (routes)')
+    parser.add_argument('--latency', type=float, default=0.02, help='giây trễ mỗi response của fake server')
+    parser.add_argument('--jitter', type=float, default=0.01)
+    parser.add_argument('--weight-limit', type=int, default=None, help='weight/phút của fake server (mặc định không giới hạn)')
+    parser.add_argument('--client-weight-limit', type=int, default=1000000, help='BINANCE_WEIGHT_LIMIT phía client')
+    parser.add_argument('--recorded', help='file JSON {symbol: [kline]} để fake server phát lại')
+    parser.add_argument('--trace-memory', action='store_true', help='đo đỉnh bộ nhớ Python bằng tracemalloc (chậm hơn)')
+    parser.add_argument('--json', help='ghi kết quả ra file JSON')
+    parser.add_argument('--baseline', help='file JSON của lần chạy trước để so sánh')
+    args = parser.parse_args()
+
+    # Đường dẫn tương đối tính theo thư mục hiện tại, trước khi chuyển sang thư mục tạm
+    for name in ('json', 'baseline', 'recorded'):
+        if getattr(args, name):
+            setattr(args, name, os.path.abspath(getattr(args, name)))
+
+    recorded = load_recorded(args.recorded) if args.recorded else None
+    fake = FakeBinance(args.latency, args.jitter, args.weight_limit, recorded, market=market_symbols(args.market)).start()
+    workdir = tempfile.mkdtemp(prefix='binance-bench-')
+    configure_environment(fake, workdir, args)
+    print(f"Fake Binance: {fake.base_url} (latency {args.latency}s + {args.jitter}s jitter), workdir {workdir}")
+
+    suites = ('scan', 'history', 'routes', 'market', 'stream') if args.suite == 'all' else (args.suite,)
+    runners = {'scan': bench_scan, 'history': bench_history, 'routes': bench_routes, 'market': bench_market, 'stream': bench_stream}
+    results = []
+    for suite in suites:
+        results.extend(runners[suite](fake, args))
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)['results']
+    print()
+    print_results(results, baseline)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'args': vars(args), 'results': results}, f, indent=2)
+    fake.stop()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,431 @@
+"""
+Local stand-in for the Binance Spot REST API used by the benchmarks.
+
+Serves /api/v3/klines, /ticker/price, /ticker/24hr, /order, /allOrders
+and /ping with
+synthetic (or recorded) candles, a configurable response latency and a
+per-minute request-weight budget that answers 429 + Retry-After like the
+real API. Every call is counted per endpoint so the harness can report
+upstream calls per operation.
+
+FakeKlineStream stands in for the combined WebSocket stream
+(/stream?streams=...): it records the SUBSCRIBE/UNSUBSCRIBE requests it
+receives and pushes synthetic kline events to the subscribed connections.
+
+    python bench/fake_binance.py --port 9900 --latency 0.05
+    python bench/fake_binance.py --stream-port 9901  # BINANCE_STREAM_URL=ws://127.0.0.1:9901/stream
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import sys
+import threading
+import time
+import zlib
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+from websockets.asyncio.server import serve
+
+# Không import kline_store/binance_client ở đây: chúng đọc BINANCE_BASE_URL lúc import,
+# trong khi harness chỉ biết địa chỉ fake server sau khi khởi động nó
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from rate_limiter import endpoint_weight
+
+API_PREFIX = '/api/v3'
+DEFAULT_LIMIT = 500
+MAX_LIMIT = 1000
+UNIT_MS = {'s': 1000, 'm': 60 * 1000, 'h': 60 * 60 * 1000, 'd': 24 * 60 * 60 * 1000, 'w': 7 * 24 * 60 * 60 * 1000}
+
+def interval_to_ms(interval):
+    # '1m', '5m', '1h', '1d'... -> ms; None nếu không hợp lệ
+    if not interval or interval[-1] not in UNIT_MS or not interval[:-1].isdigit():
+        return None
+    return int(interval[:-1]) * UNIT_MS[interval[-1]]
+
+def synthetic_kline(symbol, interval_ms, open_time):
+    # Giá dao động quanh một mức riêng của từng symbol, tất định theo (symbol, open_time)
+    seed = zlib.crc32(symbol.encode())
+    base = 10 ** ((seed % 900) / 100 - 4)  # từ 0.0001 đến ~1e5
+    step = open_time // interval_ms
+    rng = random.Random(seed ^ step)
+    mid = base * (1 + 0.05 * math.sin(step / 97 + seed) + 0.02 * math.sin(step / 11))
+    open_price = mid * (1 + rng.uniform(-0.002, 0.002))
+    close_price = mid * (1 + rng.uniform(-0.002, 0.002))
+    high = max(open_price, close_price) * (1 + rng.uniform(0, 0.003))
+    low = min(open_price, close_price) * (1 - rng.uniform(0, 0.003))
+    volume = rng.uniform(10, 1000)
+    return [
+        open_time, f'{open_price:.8f}', f'{high:.8f}', f'{low:.8f}', f'{close_price:.8f}', f'{volume:.8f}',
+        open_time + interval_ms - 1, f'{volume * mid:.8f}', rng.randint(10, 500), '0', '0', '0'
+    ]
+
+class FakeBinance:
+    """
+    The fake API state: latency, weight budget, recorded candles and call
+    counters. start() serves it on 127.0.0.1 from a daemon thread.
+    """
+
+    def __init__(self, latency=0.0, jitter=0.0, weight_limit=None, recorded=None, invalid_symbols=('INVALIDUSDT',), market=()):
+        self.latency = latency
+        self.jitter = jitter
+        self.weight_limit = weight_limit  # None = không giới hạn
+        self.recorded = recorded or {}  # symbol -> [kline] đã ghi sẵn, sắp theo open_time
+        self.invalid_symbols = set(invalid_symbols)
+        self.market = list(market)  # các symbol trả về khi gọi ticker không có tham số symbol
+        self._tickers = (None, None)  # (nến 5m hiện tại, danh sách ticker 24h đã tính)
+        self.calls = Counter()
+        self.rate_limited = 0
+        self.orders = []
+        self._window_start = time.time()
+        self._window_weight = 0
+        self._lock = threading.Lock()
+        self.server = None
+
+    @property
+    def base_url(self):
+        host, port = self.server.server_address[:2]
+        return f'http://{host}:{port}{API_PREFIX}'
+
+    def start(self, port=0):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                fake.handle(self, 'GET')
+
+            def do_POST(self):
+                fake.handle(self, 'POST')
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+
+    def reset_counters(self):
+        with self._lock:
+            self.calls.clear()
+            self.rate_limited = 0
+
+    def total_calls(self):
+        with self._lock:
+            return sum(self.calls.values())
+
+    def _spend_weight(self, weight):
+        # Cửa sổ 1 phút cố định như REQUEST_WEIGHT của Binance; trả về (được phép, weight đã dùng)
+        with self._lock:
+            now = time.time()
+            if now - self._window_start >= 60:
+                self._window_start = now - (now % 60)
+                self._window_weight = 0
+            if self.weight_limit is not None and self._window_weight + weight > self.weight_limit:
+                self.rate_limited += 1
+                return False, self._window_weight, 60 - (now - self._window_start)
+            self._window_weight += weight
+            return True, self._window_weight, 0
+
+    def handle(self, handler, method):
+        url = urlparse(handler.path)
+        params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        if method == 'POST':
+            length = int(handler.headers.get('Content-Length') or 0)
+            if length:
+                body = handler.rfile.read(length).decode()
+                params.update({key: values[-1] for key, values in parse_qs(body).items()})
+
+        path = url.path[len(API_PREFIX):] if url.path.startswith(API_PREFIX) else url.path
+        with self._lock:
+            self.calls[path] += 1
+
+        if self.latency or self.jitter:
+            time.sleep(self.latency + random.uniform(0, self.jitter))
+
+        allowed, used, retry_after = self._spend_weight(endpoint_weight(path, params))
+        headers = {'X-MBX-USED-WEIGHT-1M': str(used)}
+        if not allowed:
+            headers['Retry-After'] = str(max(1, math.ceil(retry_after)))
+            return self._send(handler, 429, {'code': -1003, 'msg': 'Too many requests.'}, headers)
+
+        route = {
+            '/ping': self._ping,
+            '/klines': self._klines,
+            '/ticker/price': self._ticker_price,
+            '/ticker/24hr': self._ticker_24hr,
+            '/order': self._order,
+            '/allOrders': self._all_orders,
+        }.get(path)
+        if route is None:
+            return self._send(handler, 404, {'code': -1, 'msg': f'Unknown path {path}'}, headers)
+        status, payload = route(method, params)
+        return self._send(handler, status, payload, headers)
+
+    def _send(self, handler, status, payload, headers):
+        body = json.dumps(payload).encode()
+        handler.send_response(status)
+        handler.send_header('Content-Type', 'application/json')
+        handler.send_header('Content-Length', str(len(body)))
+        for key, value in headers.items():
+            handler.send_header(key, value)
+        handler.end_headers()
+        handler.wfile.write(body)
+
+    def _invalid(self, symbol):
+        return symbol is None or symbol in self.invalid_symbols
+
+    def _ping(self, method, params):
+        return 200, {}
+
+    def _klines(self, method, params):
+        symbol = params.get('symbol')
+        interval = params.get('interval')
+        if self._invalid(symbol):
+            return 400, {'code': -1121, 'msg': 'Invalid symbol.'}
+        interval_ms = interval_to_ms(interval)
+        if interval_ms is None:
+            return 400, {'code': -1120, 'msg': 'Invalid interval.'}
+
+        limit = min(int(params.get('limit', DEFAULT_LIMIT)), MAX_LIMIT)
+        now_ms = int(time.time() * 1000)
+        end_time = min(int(params.get('endTime', now_ms)), now_ms)
+        if 'startTime' in params:
+            start_time = int(params['startTime'])
+        else:
+            start_time = end_time - (limit - 1) * interval_ms
+
+        recorded = self.recorded.get(symbol)
+        if recorded is not None:
+            rows = [row for row in recorded if start_time <= row[0] <= end_time][:limit]
+            return 200, rows
+
+        first_open = -(-start_time // interval_ms) * interval_ms  # nến đầu tiên có open_time >= startTime
+        opens = range(first_open, end_time + 1, interval_ms)[:limit]
+        return 200, [synthetic_kline(symbol, interval_ms, open_time) for open_time in opens]
+
+    def _ticker_price(self, method, params):
+        minute = int(time.time() * 1000) // UNIT_MS['m'] * UNIT_MS['m']
+        symbol = params.get('symbol')
+        if symbol is not None:
+            if self._invalid(symbol):
+                return 400, {'code': -1121, 'msg': 'Invalid symbol.'}
+            return 200, {'symbol': symbol, 'price': synthetic_kline(symbol, UNIT_MS['m'], minute)[4]}
+        if 'symbols' in params:
+            # symbols=["A","B"]: như Binance, một symbol sai làm hỏng cả request
+            try:
+                symbols = json.loads(params['symbols'])
+            except ValueError:
+                return 400, {'code': -1100, 'msg': 'Illegal characters found in parameter symbols.'}
+            if any(self._invalid(symbol) for symbol in symbols):
+                return 400, {'code': -1121, 'msg': 'Invalid symbol.'}
+            return 200, [{'symbol': symbol, 'price': synthetic_kline(symbol, UNIT_MS['m'], minute)[4]} for symbol in symbols]
+        return 200, [{'symbol': symbol, 'price': '0'} for symbol in sorted(self.recorded)]
+
+    def _ticker_24hr(self, method, params):
+        symbol = params.get('symbol')
+        if symbol is not None:
+            if self._invalid(symbol):
+                return 400, {'code': -1121, 'msg': 'Invalid symbol.'}
+            return 200, self._ticker_stats(symbol, int(time.time() * 1000))
+
+        # Cả thị trường: tính lại mỗi nến 5m vì phải sinh 288 nến cho từng symbol
+        step = 5 * UNIT_MS['m']
+        slot = int(time.time() * 1000) // step
+        cached_slot, tickers = self._tickers
+        if cached_slot != slot:
+            tickers = [self._ticker_stats(symbol, slot * step) for symbol in self.market]
+            self._tickers = (slot, tickers)
+        return 200, tickers
+
+    def _ticker_stats(self, symbol, now_ms):
+        # Thống kê 24h trượt từ chính các nến 5m tổng hợp, nên highPrice/lowPrice khớp với /klines
+        step = 5 * UNIT_MS['m']
+        last_open = now_ms // step * step
+        rows = [synthetic_kline(symbol, step, open_time) for open_time in range(last_open - 287 * step, last_open + 1, step)]
+        open_price = float(rows[0][1])
+        last_price = float(rows[-1][4])
+        return {
+            'symbol': symbol,
+            'priceChangePercent': f'{(last_price - open_price) / open_price * 100:.3f}',
+            'openPrice': rows[0][1],
+            'highPrice': max(rows, key=lambda row: float(row[2]))[2],
+            'lowPrice': min(rows, key=lambda row: float(row[3]))[3],
+            'lastPrice': rows[-1][4],
+            'volume': f'{sum(float(row[5]) for row in rows):.8f}',
+            'quoteVolume': f'{sum(float(row[7]) for row in rows):.8f}',
+            'openTime': rows[0][0],
+            'closeTime': rows[-1][6],
+            'count': sum(row[8] for row in rows)
+        }
+
+    def _order(self, method, params):
+        if method != 'POST':
+            return 405, {'code': -1, 'msg': 'Method not allowed.'}
+        if self._invalid(params.get('symbol')):
+            return 400, {'code': -1121, 'msg': 'Invalid symbol.'}
+        with self._lock:
+            order = {
+                'symbol': params.get('symbol'),
+                'orderId': len(self.orders) + 1,
+                'side': params.get('side'),
+                'type': params.get('type'),
+                'origQty': params.get('quantity'),
+                'price': params.get('price', '0'),
+                'status': 'NEW',
+                'time': int(time.time() * 1000)
+            }
+            self.orders.append(order)
+        return 200, order
+
+    def _all_orders(self, method, params):
+        symbol = params.get('symbol')
+        with self._lock:
+            return 200, [order for order in self.orders if order['symbol'] == symbol]
+
+class FakeKlineStream:
+    """
+    The fake combined kline stream. Keeps the streams each connection is
+    subscribed to (from ?streams= and later SUBSCRIBE/UNSUBSCRIBE), answers
+    those requests like Binance and records them in order so the harness
+    can check what the client sent. start() serves it on 127.0.0.1 from a
+    daemon thread.
+    """
+
+    def __init__(self):
+        self.requests = []  # các message SUBSCRIBE/UNSUBSCRIBE đã nhận, theo thứ tự
+        self.connections = 0
+        self._subscriptions = {}  # kết nối -> tập stream đang đăng ký
+        self._lock = threading.Lock()
+        self._loop = None
+        self._stopping = None
+        self.port = None
+
+    @property
+    def url(self):
+        return f'ws://127.0.0.1:{self.port}/stream'
+
+    def start(self, port=0):
+        started = threading.Event()
+        threading.Thread(target=lambda: asyncio.run(self._serve(port, started)), daemon=True).start()
+        started.wait()
+        return self
+
+    def stop(self):
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._stopping.set)
+
+    async def _serve(self, port, started):
+        self._loop = asyncio.get_running_loop()
+        self._stopping = asyncio.Event()
+        async with serve(self._handle, '127.0.0.1', port) as server:
+            self.port = server.sockets[0].getsockname()[1]
+            started.set()
+            await self._stopping.wait()
+
+    async def _handle(self, ws):
+        query = parse_qs(urlparse(ws.request.path).query)
+        streams = {stream for stream in query.get('streams', [''])[0].split('/') if stream}
+        with self._lock:
+            self._subscriptions[ws] = streams
+            self.connections += 1
+        try:
+            async for raw in ws:
+                try:
+                    message = json.loads(raw)
+                except ValueError:
+                    continue
+                method = message.get('method')
+                params = message.get('params') or []
+                with self._lock:
+                    self.requests.append(message)
+                    if method == 'SUBSCRIBE':
+                        self._subscriptions[ws].update(params)
+                    elif method == 'UNSUBSCRIBE':
+                        self._subscriptions[ws].difference_update(params)
+                await ws.send(json.dumps({'result': None, 'id': message.get('id')}))
+        finally:
+            with self._lock:
+                self._subscriptions.pop(ws, None)
+
+    def subscribed(self):
+        # Hợp các stream đang được đăng ký trên mọi kết nối
+        with self._lock:
+            return set().union(*self._subscriptions.values())
+
+    def push_kline(self, symbol, interval='5m', open_time=None, closed=True):
+        """
+        Send a kline event for symbol to every connection subscribed to
+        <symbol>@kline_<interval>. open_time defaults to the candle that just
+        closed. Returns the number of connections it was sent to.
+        """
+        interval_ms = interval_to_ms(interval)
+        if open_time is None:
+            open_time = int(time.time() * 1000) // interval_ms * interval_ms - interval_ms
+        row = synthetic_kline(symbol, interval_ms, open_time)
+        stream = f'{symbol.lower()}@kline_{interval}'
+        payload = json.dumps({'stream': stream, 'data': {
+            'e': 'kline', 'E': int(time.time() * 1000), 's': symbol,
+            'k': {
+                't': row[0], 'T': row[6], 's': symbol, 'i': interval,
+                'o': row[1], 'c': row[4], 'h': row[2], 'l': row[3], 'v': row[5],
+                'n': row[8], 'x': closed, 'q': row[7], 'V': row[9], 'Q': row[10], 'B': '0'
+            }
+        }})
+        return asyncio.run_coroutine_threadsafe(self._broadcast(stream, payload), self._loop).result()
+
+    async def _broadcast(self, stream, payload):
+        with self._lock:
+            targets = [ws for ws, streams in self._subscriptions.items() if stream in streams]
+        for ws in targets:
+            await ws.send(payload)
+        return len(targets)
+
+def market_symbols(count, quote='USDT'):
+    # Thị trường giả: count cặp theo quote và vài cặp BTC để kiểm tra bộ lọc
+    return [f'MKT{index:04d}{quote}' for index in range(count)] + [f'MKT{index:04d}BTC' for index in range(min(count, 10))]
+
+def load_recorded(path):
+    # File JSON {symbol: [kline, ...]} ghi từ API thật
+    with open(path, 'r') as f:
+        data = json.load(f)
+    return {symbol: sorted(rows, key=lambda row: row[0]) for symbol, rows in data.items()}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--port', type=int, default=9900)
+    parser.add_argument('--latency', type=float, default=0.0, help='giây trễ cố định mỗi response')
+    parser.add_argument('--jitter', type=float, default=0.0, help='giây trễ ngẫu nhiên cộng thêm')
+    parser.add_argument('--weight-limit', type=int, default=None, help='weight tối đa mỗi phút (mặc định: không giới hạn)')
+    parser.add_argument('--recorded', help='file JSON {symbol: [kline]} để phát lại')
+    parser.add_argument('--market', type=int, default=0, help='số cặp USDT tổng hợp trả về bởi /ticker/24hr')
+    parser.add_argument('--stream-port', type=int, default=None, help='mở thêm kline stream giả ở cổng này')
+    args = parser.parse_args()
+
+    recorded = load_recorded(args.recorded) if args.recorded else None
+    fake = FakeBinance(args.latency, args.jitter, args.weight_limit, recorded, market=market_symbols(args.market)).start(args.port)
+    print(f"Fake Binance: {fake.base_url}")
+    stream = None
+    if args.stream_port is not None:
+        stream = FakeKlineStream().start(args.stream_port)
+        print(f"Fake kline stream: {stream.url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        fake.stop()
+        if stream is not None:
+            stream.stop()
+
+if __name__ == '__main__':
+    main()
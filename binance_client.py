@@ -0,0 +1,161 @@
+import os
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from dotenv import load_dotenv
+import metrics
+from circuit_breaker import CLOSED, CircuitBreaker
+from rate_limiter import WeightRateLimiter, endpoint_weight
+
+# Load environment variables (bot.py/app.py import module này trước khi gọi load_dotenv)
+load_dotenv()
+
+# BASE_URL = 'https://testnet.binance.vision/api/v3'  # Dùng testnet cho các lệnh cần xác thực
+BASE_URL = os.getenv('BINANCE_BASE_URL', 'https://api.binance.com/api/v3')
+
+# Cấu hình connection pool và timeout (giây)
+POOL_SIZE = int(os.getenv('BINANCE_POOL_SIZE', 20))
+CONNECT_TIMEOUT = float(os.getenv('BINANCE_CONNECT_TIMEOUT', 3.05))
+READ_TIMEOUT = float(os.getenv('BINANCE_READ_TIMEOUT', 10))
+
+# Số lần thử lại và hệ số backoff: chờ BACKOFF_FACTOR * 2^(n-1) giây giữa các lần thử
+MAX_RETRIES = int(os.getenv('BINANCE_MAX_RETRIES', 3))
+BACKOFF_FACTOR = float(os.getenv('BINANCE_BACKOFF_FACTOR', 0.5))
+
+# Giới hạn request weight mỗi phút của Binance (REQUEST_WEIGHT / 1 phút)
+WEIGHT_LIMIT = int(os.getenv('BINANCE_WEIGHT_LIMIT', 6000))
+# Thời gian chờ mặc định khi bị 429/418 mà không có Retry-After (giây)
+DEFAULT_RETRY_AFTER = 60
+
+# Circuit breaker: số lỗi kết nối liên tiếp trước khi ngắt, thời gian chờ ban đầu và tối đa (giây)
+BREAKER_FAILURE_THRESHOLD = int(os.getenv('BINANCE_BREAKER_FAILURE_THRESHOLD', 3))
+BREAKER_BASE_DELAY = float(os.getenv('BINANCE_BREAKER_BASE_DELAY', 5))
+BREAKER_MAX_DELAY = float(os.getenv('BINANCE_BREAKER_MAX_DELAY', 300))
+
+_session = None
+_session_lock = threading.Lock()
+
+# Rate limiter dùng chung cho mọi luồng trong process
+limiter = WeightRateLimiter(WEIGHT_LIMIT)
+# Trạng thái kết nối suy ra từ kết quả của chính các request, không cần kiểm tra mạng riêng
+breaker = CircuitBreaker(BREAKER_FAILURE_THRESHOLD, BREAKER_BASE_DELAY, BREAKER_MAX_DELAY)
+
+REQUEST_LATENCY = metrics.histogram(
+    'binance_request_duration_seconds', 'Binance REST latency (without rate-limit wait)',
+    ('endpoint', 'method', 'status')
+)
+REQUEST_WEIGHT = metrics.counter('binance_request_weight_total', 'Request weight spent per endpoint', ('endpoint',))
+RATE_LIMIT_WAIT = metrics.histogram('binance_rate_limit_wait_seconds', 'Time spent waiting for rate-limit tokens', ('endpoint',))
+USED_WEIGHT = metrics.gauge('binance_used_weight_1m', 'Last X-MBX-USED-WEIGHT-1M reported by Binance')
+WEIGHT_LIMIT_GAUGE = metrics.gauge('binance_weight_limit_1m', 'Configured request weight limit per minute')
+AVAILABLE_WEIGHT = metrics.gauge('binance_weight_tokens_available', 'Weight tokens left in the local bucket')
+CIRCUIT_OPEN = metrics.gauge('binance_circuit_open', '1 while the connectivity circuit breaker is not closed')
+
+def _collect_metrics():
+    USED_WEIGHT.set(limiter.used_weight)
+    WEIGHT_LIMIT_GAUGE.set(WEIGHT_LIMIT)
+    AVAILABLE_WEIGHT.set(limiter.available())
+    CIRCUIT_OPEN.set(0 if breaker.state == CLOSED else 1)
+
+metrics.REGISTRY.add_collector(_collect_metrics)
+
+class CircuitOpenError(requests.exceptions.ConnectionError):
+    """
+    Raised instead of sending a request while the circuit is open.
+    """
+
+def _build_session():
+    # Chỉ retry các lệnh GET khi server lỗi, không retry POST /order để tránh đặt lệnh trùng
+    retry = Retry(
+        total=MAX_RETRIES,
+        backoff_factor=BACKOFF_FACTOR,
+        status_forcelist=(500, 502, 503, 504),
+        allowed_methods=frozenset(['GET']),
+        raise_on_status=False
+    )
+    adapter = HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE, max_retries=retry)
+
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+def get_session():
+    """
+    Return the shared keep-alive session, creating it on first use.
+    """
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                _session = _build_session()
+    return _session
+
+def request(method, path, params=None, headers=None, timeout=None):
+    # path có thể là đường dẫn tương đối ('/klines') hoặc URL đầy đủ
+    if path.startswith(BASE_URL):
+        path = path[len(BASE_URL):]
+    url = path if path.startswith('http') else f'{BASE_URL}{path}'
+    if timeout is None:
+        timeout = (CONNECT_TIMEOUT, READ_TIMEOUT)
+
+    endpoint = path if not path.startswith('http') else 'other'
+    if not breaker.allow():
+        REQUEST_LATENCY.observe(0.0, endpoint=endpoint, method=method, status='circuit_open')
+        raise CircuitOpenError(f'Mất kết nối Binance, thử lại sau {breaker.retry_in():.0f} giây')
+
+    weight = endpoint_weight(path, params)
+    with RATE_LIMIT_WAIT.time(endpoint=endpoint):
+        limiter.acquire(weight)
+    REQUEST_WEIGHT.inc(weight, endpoint=endpoint)
+
+    started = time.perf_counter()
+    try:
+        response = get_session().request(method, url, params=params, headers=headers, timeout=timeout)
+    except requests.exceptions.RequestException:
+        REQUEST_LATENCY.observe(time.perf_counter() - started, endpoint=endpoint, method=method, status='error')
+        breaker.record_failure()
+        raise
+    REQUEST_LATENCY.observe(time.perf_counter() - started, endpoint=endpoint, method=method, status=response.status_code)
+    limiter.update_from_headers(response.headers)
+
+    # 5xx (sau khi đã retry) coi như Binance không khả dụng
+    if response.status_code >= 500:
+        breaker.record_failure()
+    else:
+        breaker.record_success()
+
+    # 429: vượt giới hạn, 418: IP bị ban -> tạm dừng toàn bộ request theo Retry-After
+    if response.status_code in (429, 418):
+        try:
+            retry_after = float(response.headers.get('Retry-After', DEFAULT_RETRY_AFTER))
+        except ValueError:
+            retry_after = DEFAULT_RETRY_AFTER
+        limiter.block(retry_after)
+
+    return response
+
+def ping():
+    """
+    Cheap probe (weight 1) used while the circuit is not closed.
+    Returns True when Binance answered.
+    """
+    try:
+        return get('/ping').status_code == 200
+    except requests.exceptions.RequestException:
+        return False
+
+def get(path, params=None, headers=None, timeout=None):
+    return request('GET', path, params=params, headers=headers, timeout=timeout)
+
+def post(path, params=None, headers=None, timeout=None):
+    return request('POST', path, params=params, headers=headers, timeout=timeout)
+
+def close():
+    global _session
+    with _session_lock:
+        if _session is not None:
+            _session.close()
+            _session = None
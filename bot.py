@@ -1,88 +1,131 @@
-import math
 import os
+import signal
 import time
 from flask import jsonify, request
-import requests
 import telebot
-import json
 import threading
 import schedule
 from datetime import datetime, timedelta
 from pytz import timezone
 from dotenv import load_dotenv
-import socket
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+import binance_client
+import metrics
+from circuit_breaker import CLOSED
+import kline_store
+import market_scanner
+from intraday_state import IntradayTracker
+from kline_stream import KlineStream
+from ratio_store import RatioStore
+from chat_registry import ChatRegistry
+from telegram_outbox import TelegramOutbox
+from scheduler import AlignedScheduler, staggered
 
 # Load environment variables
 load_dotenv()
 
 # Cấu hình bot Telegram
 BOT_TOKEN = os.getenv("BOT_TOKEN")
-BASE_URL = 'https://api.binance.com/api/v3'
 
 # Tạo bot Telegram
 bot = telebot.TeleBot(BOT_TOKEN)
+# Hàng đợi gửi tin: giãn cách theo từng chat và toàn cục (tin/giây), handler và scanner không phải chờ Telegram
+TELEGRAM_CHAT_INTERVAL = float(os.getenv('TELEGRAM_CHAT_INTERVAL', 1.0))
+TELEGRAM_GLOBAL_RATE = float(os.getenv('TELEGRAM_GLOBAL_RATE', 25))
+outbox = TelegramOutbox(bot, chat_interval=TELEGRAM_CHAT_INTERVAL, global_rate=TELEGRAM_GLOBAL_RATE)
 CHECKLIST_FILE = 'checklist.txt'
+# Mỗi chat có danh sách coin riêng trong CHECKLIST_DIR/<chat_id>.txt (chat đầu tiên dùng lại checklist.txt)
+CHECKLIST_DIR = 'checklists'
+CHATS_FILE = 'chats.json'
+# Mức tăng tỉ lệ tối thiểu để gửi cảnh báo, mỗi chat có thể đổi bằng /threshold
+DEFAULT_RATIO_THRESHOLD = float(os.getenv('RATIO_THRESHOLD', 0.01))
 PREVIOUS_RATIO_FILE = 'previous_ratios.json'
-USER_CHAT_ID = None  # Biến toàn cục để lưu chat_id
-
-def is_connected():
-    try:
-        # Kiểm tra kết nối tới Google DNS (hoặc một host đáng tin cậy khác)
-        socket.create_connection(("8.8.8.8", 53), timeout=5)
+# previous_ratios giữ trong bộ nhớ, ghi xuống file theo lô mỗi RATIO_FLUSH_INTERVAL giây
+RATIO_FLUSH_INTERVAL = float(os.getenv('RATIO_FLUSH_INTERVAL', 5))
+ratio_store = RatioStore(PREVIOUS_RATIO_FILE, flush_interval=RATIO_FLUSH_INTERVAL)
+# Số request klines chạy song song tối đa (nên <= BINANCE_POOL_SIZE)
+FETCH_CONCURRENCY = int(os.getenv('FETCH_CONCURRENCY', 10))
+# Trạng thái cao/thấp trong ngày của từng symbol, cập nhật dần theo từng tick
+intraday_tracker = IntradayTracker('5m')
+
+# Chế độ lấy dữ liệu: 'poll' (gọi REST theo TIME_SET) hoặc 'stream' (WebSocket kline)
+BOT_MODE = os.getenv('BOT_MODE', 'poll')
+# Số giây chờ gom các nến đóng cùng một mốc trước khi đánh giá tỉ lệ (chế độ stream)
+STREAM_EVALUATE_DELAY = 3
+kline_stream_client = None
+
+# Khi một lượt quét chạy quá mốc kế tiếp: 'skip' bỏ các mốc đã lỡ, 'coalesce' chạy bù ngay một lần
+SCHEDULE_OVERRUN = os.getenv('SCHEDULE_OVERRUN', 'skip')
+# Chia danh sách coin thành từng lô FETCH_BATCH_SIZE symbol, rải đều trong FETCH_STAGGER_WINDOW giây
+# đầu mỗi lượt (0 = lấy tất cả cùng lúc); nên giữ cửa sổ nhỏ hơn nhiều so với chu kỳ TIME_SET
+FETCH_BATCH_SIZE = int(os.getenv('FETCH_BATCH_SIZE', 0))
+FETCH_STAGGER_WINDOW = float(os.getenv('FETCH_STAGGER_WINDOW', 0))
+tick_scheduler = None
+
+# Cổng HTTP xuất /metrics (định dạng Prometheus) của tiến trình bot, 0 = tắt (mặc định).
+# Endpoint không xác thực nên chỉ nghe trên localhost, trừ khi đặt BOT_METRICS_HOST
+BOT_METRICS_PORT = int(os.getenv('BOT_METRICS_PORT', 0))
+BOT_METRICS_HOST = os.getenv('BOT_METRICS_HOST', '127.0.0.1')
+SCAN_PHASE = metrics.histogram('scan_phase_duration_seconds', 'Duration of each phase of a scan tick', ('phase',))
+SCAN_TICK = metrics.histogram('scan_tick_duration_seconds', 'Total duration of a scheduled scan tick')
+SCAN_TICK_LAG = metrics.gauge('scan_tick_lag_seconds', 'Delay of the last tick behind its slot')
+SCAN_OVERRUNS = metrics.counter('scan_overruns_total', 'Ticks that ran past the next slot')
+SCAN_SKIPPED = metrics.counter('scan_skipped_slots_total', 'Slots skipped because of overruns')
+WATCHED_SYMBOLS = metrics.gauge('bot_watched_symbols', 'Distinct symbols watched by all chats')
+SUBSCRIBED_CHATS = metrics.gauge('bot_chats', 'Chats registered for alerts')
+OUTBOX_PENDING = metrics.gauge('telegram_outbox_pending', 'Messages waiting in the Telegram outbox')
+
+# Thời gian chờ ban đầu và tối đa (giây) khi bot.polling lỗi, tăng gấp đôi sau mỗi lần lỗi
+POLLING_RETRY_DELAY = 5
+POLLING_MAX_RETRY_DELAY = 300
+
+def binance_available():
+    """
+    Connectivity check backed by the shared circuit breaker: free while the
+    circuit is closed, otherwise one /ping probe once the cooldown is over.
+    """
+    if binance_client.breaker.state == CLOSED:
         return True
-    except OSError:
+    if binance_client.breaker.retry_in() > 0:
         return False
-    
-def load_previous_ratios():
-    if os.path.exists(PREVIOUS_RATIO_FILE):
-        with open(PREVIOUS_RATIO_FILE, 'r') as f:
-            try:
-                ratios = json.load(f)
-                return ratios
-            except json.JSONDecodeError:
-                return {}
-    return {}
-
-def save_previous_ratios(ratios):
-    with open(PREVIOUS_RATIO_FILE, 'w') as f:
-        json.dump(ratios, f)
-
-def read_coin_list():
-    if not os.path.exists(CHECKLIST_FILE):
-        return []
-    
-    with open(CHECKLIST_FILE, 'r') as f:
-        # Lọc bỏ các dòng trống và chuẩn hóa dữ liệu
-        coins = [coin.strip().upper() for coin in f.readlines() if coin.strip()]
-    
-    # Ghi danh sách đã loại bỏ dòng trống trở lại tệp
-    with open(CHECKLIST_FILE, 'w') as f:
-        for coin in coins:
-            f.write(f"{coin}\n")
-    
-    return coins
+    return binance_client.ping()
+
+def on_watchlist_changed(coins):
+    # coins: hợp danh sách của mọi chat; đăng ký lại stream khi thay đổi (/add, /remove hoặc sửa tay file)
+    if kline_stream_client is not None:
+        kline_stream_client.update_symbols(coins)
+
+# Các chat nhận cảnh báo, mỗi chat một danh sách coin (giữ trong bộ nhớ, chỉ ghi khi /add, /remove) và một ngưỡng
+chat_registry = ChatRegistry(
+    CHATS_FILE, CHECKLIST_DIR, DEFAULT_RATIO_THRESHOLD,
+    legacy_checklist=CHECKLIST_FILE, on_change=on_watchlist_changed
+)
 
-def write_coin_list(coins):
-    with open(CHECKLIST_FILE, 'w') as f:
-        for coin in coins:
-            f.write(f"{coin.upper()}\n")
+def get_watchlist(chat_id):
+    # Chat đầu tiên đăng ký nhận lại checklist.txt và previous_ratios của bản một chat
+    if chat_registry.register(chat_id) and chat_registry.is_legacy(chat_id):
+        ratio_store.adopt_legacy(chat_id)
+    return chat_registry.watchlist(chat_id)
+
+def read_coin_list(chat_id):
+    return get_watchlist(chat_id).symbols()
 
 # Thêm handler để lưu chat_id khi start bot
 @bot.message_handler(commands=['start'])
 def start_handler(message):
-    global USER_CHAT_ID
-    USER_CHAT_ID = message.chat.id
+    chat_id = message.chat.id
 
     # Thêm giờ trong thông báo bắt đầu
     utc_tz = timezone('UTC')
     current_time_utc = datetime.now(utc_tz).strftime('%H:%M - %d.%m.%y')
-    bot.reply_to(message, f"Bắt đầu theo dõi coin theo danh sách lúc {current_time_utc} UTC.")
+    outbox.reply_to(message, f"Bắt đầu theo dõi coin theo danh sách lúc {current_time_utc} UTC.")
 
     try:
-        # Đọc danh sách coin hiện tại từ checklist.txt
-        current_coins = read_coin_list()
+        # Đọc danh sách coin hiện tại của chat
+        current_coins = read_coin_list(chat_id)
         if not current_coins:
-            bot.reply_to(message, "Danh sách coin trống. Vui lòng thêm coin bằng lệnh /add.")
+            outbox.reply_to(message, "Danh sách coin trống. Vui lòng thêm coin bằng lệnh /add.")
             return
 
         # Lấy dữ liệu tỷ lệ theo thời gian thực
@@ -92,19 +135,13 @@ def start_handler(message):
         previous_ratios = {}  # Khởi tạo dữ liệu mới cho previous_ratios
         failed_coins = []  # Danh sách các coin không lấy được dữ liệu
 
+        # Lấy klines song song cho toàn bộ danh sách
+        klines_by_symbol = fetch_klines_concurrently(current_coins, chunk_start, chunk_end)
+
         for symbol in current_coins:
             try:
-                params = {
-                    'symbol': symbol,
-                    'interval': '5m',
-                    'startTime': int(chunk_start.timestamp() * 1000),
-                    'endTime': int(chunk_end.timestamp() * 1000),
-                    'limit': 500
-                }
-                response = fetch_binance_data(f"{BASE_URL}/klines", params=params)
-                data = response.json()
-
-                if response.status_code != 200 or not data or not isinstance(data, list):
+                data = klines_by_symbol.get(symbol)
+                if not data:
                     failed_coins.append(symbol)
                     continue
 
@@ -128,80 +165,67 @@ def start_handler(message):
                 print(f"Lỗi khi xử lý coin {symbol}: {e}")
                 failed_coins.append(symbol)
 
-        # Lưu dữ liệu mới vào tệp previous_ratios
-        save_previous_ratios(previous_ratios)
+        # Thay toàn bộ previous_ratios bằng dữ liệu mới
+        ratio_store.replace(chat_id, previous_ratios)
 
         # Gửi thông báo về các coin không lấy được dữ liệu
         if failed_coins:
             response_message = "Không thể lấy dữ liệu cho các coin sau:\n" + "\n".join(failed_coins)
-            bot.reply_to(message, response_message)
+            outbox.reply_to(message, response_message)
 
     except Exception as e:
         print(f"Lỗi: {str(e)}")
 
 @bot.message_handler(commands=['status'])
 def status_coins(message):
-    previous_ratios = load_previous_ratios()
+    previous_ratios = ratio_store.snapshot(message.chat.id)
     
     if not previous_ratios:
-        bot.reply_to(message, "Chưa có dữ liệu theo dõi coin.")
+        outbox.reply_to(message, "Chưa có dữ liệu theo dõi coin.")
         return
     
-    status_message = "Tracking time:\n\n"
+    status_message = f"Ngưỡng cảnh báo: +{chat_registry.threshold(message.chat.id):.4f}\n"
+    status_message += "Tracking time:\n\n"
     for symbol, data in previous_ratios.items():
         status_message += f"{symbol}:\n"
         status_message += f"  Tỉ lệ Cao/Thấp: {data['ratio']:.4f}\n"
         status_message += f"  Lần ghi cuối: {data.get('tracking_time', 'Không có dữ liệu')}\n\n"
     
-    # Split long status message if needed
-    split_messages = split_long_message(status_message)
-    for msg in split_messages:
-        bot.reply_to(message, msg)
+    # Outbox tự chia tin dài theo giới hạn 4096 ký tự
+    outbox.reply_to(message, status_message)
 
 @bot.message_handler(commands=['add'])
 def add_coins(message):
     try:
+        chat_id = message.chat.id
+        watchlist = get_watchlist(chat_id)
+
         # Lấy danh sách các coin cần thêm
         coins_to_add = [coin.strip().upper() for coin in message.text.split('/add')[1].replace(',', '\n').split('\n') if coin.strip()]
-        current_coins = read_coin_list()
         response_message = ""
         utc_tz = timezone('UTC')
         current_time_utc = datetime.now(utc_tz)
 
-        # Xác định các coin mới và các coin đã tồn tại
-        newly_added = [coin for coin in coins_to_add if coin not in current_coins]
-        existing_coins = [coin for coin in coins_to_add if coin in current_coins]
+        # Thêm các coin mới vào danh sách (ghi file một lần), tách các coin đã tồn tại
+        newly_added, existing_coins = watchlist.add(coins_to_add)
 
         # Nếu có coin đã tồn tại, thông báo cho người dùng
         if existing_coins:
             response_message += "Các coin sau đã tồn tại trong danh sách:\n" + "\n".join(existing_coins) + "\n"
 
-        # Thêm các coin mới vào danh sách
-        current_coins += newly_added
-
-        # Ghi danh sách cập nhật vào file
-        write_coin_list(current_coins)
-
         # Kiểm tra tính hợp lệ của các coin mới
         invalid_coins = []
         chunk_start = current_time_utc.replace(hour=0, minute=0, second=0, microsecond=0)
         chunk_end = current_time_utc
 
-        previous_ratios = load_previous_ratios()
+        previous_ratios = {}  # Tỉ lệ của các coin mới thêm
+
+        klines_by_symbol = fetch_klines_concurrently(newly_added, chunk_start, chunk_end)
 
         for symbol in newly_added:
             try:
-                params = {
-                    'symbol': symbol,
-                    'interval': '5m',
-                    'startTime': int(chunk_start.timestamp() * 1000),
-                    'endTime': int(chunk_end.timestamp() * 1000),
-                    'limit': 500
-                }
-                response = fetch_binance_data(f"{BASE_URL}/klines", params=params)
-                data = response.json()
-
-                if response.status_code != 200 or not data or not isinstance(data, list):
+                data = klines_by_symbol.get(symbol)
+                if not data:
                     invalid_coins.append(symbol)
                     continue
 
@@ -225,40 +249,36 @@ def add_coins(message):
                 invalid_coins.append(symbol)
 
         # Lưu lại previous_ratios nếu có thay đổi
-        save_previous_ratios(previous_ratios)
+        ratio_store.update(chat_id, previous_ratios)
 
         # Loại bỏ các coin không hợp lệ khỏi file và thông báo
         if invalid_coins:
-            current_coins = [coin for coin in current_coins if coin not in invalid_coins]
-            write_coin_list(current_coins)
+            watchlist.remove(invalid_coins)
             response_message += "Các coin sau không hợp lệ và đã bị xóa:\n" + "\n".join(invalid_coins)
         else:
             response_message += "Đã thêm và cập nhật các coin sau lúc " + current_time_utc.strftime('%H:%M - %d.%m.%y') + ":\n" + "\n".join(newly_added)
 
-        bot.reply_to(message, response_message)
+        outbox.reply_to(message, response_message)
     except Exception as e:
         print(f"Lỗi: {str(e)}")
 
 @bot.message_handler(commands=['remove'])
 def remove_coins(message):
     try:
+        chat_id = message.chat.id
+
         # Lấy danh sách các coin cần xóa
         coins_to_remove = [coin.strip().upper() for coin in message.text.split('/remove')[1].replace(',', '\n').split('\n') if coin.strip()]
-        current_coins = read_coin_list()
 
-        # Xác định các coin thực sự tồn tại trong danh sách hiện tại
-        valid_coins_to_remove = [coin for coin in coins_to_remove if coin in current_coins]
+        # Xóa khỏi danh sách, chỉ trả về các coin thực sự tồn tại
+        valid_coins_to_remove = get_watchlist(chat_id).remove(coins_to_remove)
 
-        # Cập nhật danh sách coin
-        updated_coins = [coin for coin in current_coins if coin not in valid_coins_to_remove]
-        write_coin_list(updated_coins)
+        # Xóa các coin hợp lệ khỏi previous_ratios của chat
+        ratio_store.remove(chat_id, valid_coins_to_remove)
 
-        # Xóa các coin hợp lệ khỏi previous_ratios
-        previous_ratios = load_previous_ratios()
-        for coin in valid_coins_to_remove:
-            if coin in previous_ratios:
-                del previous_ratios[coin]
-        save_previous_ratios(previous_ratios)
+        # Chỉ bỏ trạng thái trong ngày của các coin không còn chat nào theo dõi
+        still_watched = set(chat_registry.all_symbols())
+        intraday_tracker.discard([coin for coin in valid_coins_to_remove if coin not in still_watched])
 
         # Tạo phản hồi
         if valid_coins_to_remove:
@@ -266,46 +286,37 @@ def remove_coins(message):
         else:
             response = "Không có coin nào trong danh sách cần xóa."
 
-        bot.reply_to(message, response)
+        outbox.reply_to(message, response)
     except Exception as e:
-        bot.reply_to(message, f"Lỗi: {str(e)}")
+        outbox.reply_to(message, f"Lỗi: {str(e)}")
 
 @bot.message_handler(commands=['list'])
 def list_coins(message):
-    coins = read_coin_list()
+    coins = read_coin_list(message.chat.id)
     if coins:
         response = "Danh sách coin hiện tại:\n" + "\n".join(coins)
     else:
         response = "Danh sách coin trống."
-    bot.reply_to(message, response)
-    
-def split_long_message(message, max_length=4096):
-    """
-    Split a long message into multiple messages of specified max length.
-    Telegram has a 4096 character limit per message.
-    """
-    messages = []
-    while message:
-        # If message is shorter than max length, add it and break
-        if len(message) <= max_length:
-            messages.append(message)
-            break
-        
-        # Try to split at a newline close to max length
-        split_index = message.rfind('\n', 0, max_length)
-        
-        # If no newline found, just cut at max length
-        if split_index == -1:
-            split_index = max_length
-        
-        # Add the first part to messages
-        messages.append(message[:split_index])
-        
-        # Remove the first part from the message
-        message = message[split_index:].lstrip()
-    
-    return messages
+    outbox.reply_to(message, response)
 
+@bot.message_handler(commands=['threshold'])
+def threshold_command(message):
+    try:
+        command_parts = message.text.split()
+        if len(command_parts) == 1:
+            outbox.reply_to(message, f"Ngưỡng cảnh báo hiện tại: +{chat_registry.threshold(message.chat.id):.4f}")
+            return
+
+        threshold = float(command_parts[1])
+        if threshold <= 0:
+            raise ValueError
+
+        get_watchlist(message.chat.id)
+        chat_registry.set_threshold(message.chat.id, threshold)
+        outbox.reply_to(message, f"Đã đặt ngưỡng cảnh báo: +{threshold:.4f}")
+    except ValueError:
+        outbox.reply_to(message, "Cú pháp không đúng. Vui lòng nhập: /threshold <số dương>, ví dụ /threshold 0.02")
+    
 @bot.message_handler(commands=['help'])
 def help_command(message):
     help_text = """
@@ -327,14 +338,21 @@ Quản lý Danh Sách Coin:
 
 /status - Hiển thị lần cập nhật cuối trong file tỉ lệ cao/thấp
 
+/threshold [số] - Xem hoặc đặt mức tăng tỉ lệ tối thiểu để gửi cảnh báo
+    Ví dụ: /threshold 0.02 (mặc định 0.01)
+
 /track [coin] [days] - Theo dõi coin trong vòng [days] ngày
 
+/scan [số] - Quét toàn thị trường, liệt kê các cặp có tỉ lệ Cao/Thấp hôm nay lớn nhất
+    Ví dụ: /scan 20 (mặc định 10, tối đa 50)
+
 🤖 Hướng dẫn sử dụng:
 - Thêm coin vào danh sách để bot theo dõi và gửi thông báo
+- Mỗi chat có danh sách coin và ngưỡng cảnh báo riêng
 - Mỗi coin sẽ được phân tích giá và gửi thông báo tự động
 - Sử dụng /help để xem hướng dẫn chi tiết bất kỳ lúc nào
 """
-    bot.reply_to(message, help_text)
+    outbox.reply_to(message, help_text)
 
 @bot.message_handler(commands=['track'])
 def track_command(message):
@@ -342,7 +360,7 @@ def track_command(message):
         # Parse command input
         command_parts = message.text.split()
         if len(command_parts) != 3:
-            bot.reply_to(message, "Cú pháp không đúng. Vui lòng nhập: /track <symbol> <days>")
+            outbox.reply_to(message, "Cú pháp không đúng. Vui lòng nhập: /track <symbol> <days>")
             return
 
         symbol = command_parts[1].upper()
@@ -351,47 +369,34 @@ def track_command(message):
             if days <= 0:
                 raise ValueError
         except ValueError:
-            bot.reply_to(message, "Số ngày phải là một số nguyên dương.")
+            outbox.reply_to(message, "Số ngày phải là một số nguyên dương.")
             return
 
         # Call get_historical_data
         historical_data = get_historical_data(symbol, days)
 
-        if 'error' in historical_data:
-            bot.reply_to(message, f"Đã xảy ra lỗi: Kiểm tra lại tên symbol")
+        if isinstance(historical_data, dict) and 'error' in historical_data:
+            outbox.reply_to(message, f"Đã xảy ra lỗi: Kiểm tra lại tên symbol")
             return
 
-        # Process data to calculate high/low details per day
-        daily_stats = {}
-        for kline in historical_data:
-            date, time = kline[0].split(' - ')  # Extract date and time (dd.mm.yy - hh:mm)
-            low_price = float(kline[3])  # Column 4 is the Low price
-
-            if date not in daily_stats:
-                daily_stats[date] = {
-                    'lows': [],
-                    'ratios': []
-                }
-            
-            daily_stats[date]['lows'].append((time, low_price))
-
-        # Process ratios and prepare for sorting
+        # Process data to calculate high/low details per day (tính trên mảng numpy theo open_time)
+        lows = historical_data.low
         ratio_sorted_dates = []
-        for date, stats in daily_stats.items():
-            # Sort low prices
-            sorted_lows = sorted(stats['lows'], key=lambda x: x[1])
+        for day_start, day in historical_data.day_slices():
+            # Sort low prices (stable: cùng giá thì giữ thứ tự thời gian)
+            sorted_lows = np.argsort(lows[day], kind='stable') + day.start
             
             # Get 2 lowest and 2 highest prices
             lowest_2 = sorted_lows[:2]
             highest_2 = sorted_lows[-2:]
             
             # Calculate ratio
-            ratio = highest_2[-1][1] / lowest_2[0][1] if lowest_2[0][1] > 0 else 0
+            ratio = lows[highest_2[-1]] / lows[lowest_2[0]] if lows[lowest_2[0]] > 0 else 0
             
-            ratio_sorted_dates.append((date, ratio, lowest_2, highest_2))
+            ratio_sorted_dates.append((ratio, lowest_2, highest_2))
         
         # Sort by ratio in descending order
-        ratio_sorted_dates.sort(key=lambda x: x[1], reverse=True)
+        ratio_sorted_dates.sort(key=lambda x: x[0], reverse=True)
 
         # Log tracking start
         utc_tz = timezone('UTC')
@@ -399,31 +404,70 @@ def track_command(message):
         result_message = f"**** Tracking {symbol} at {current_time} ****\n\n"
 
         # Display results with numbered order
-        for rank, (date, ratio, lowest_2, highest_2) in enumerate(ratio_sorted_dates, 1):
+        for rank, (ratio, lowest_2, highest_2) in enumerate(ratio_sorted_dates, 1):
+            # Chỉ định dạng thời gian cho 4 nến được hiển thị
+            selected = np.r_[lowest_2, highest_2]
+            labels = historical_data[selected].format_times()
+            date = labels[0].split(' - ')[0]
+
             # Create the day's entry
             day_entry = f"{rank}) {date}\n"
             
             # Add 2 lowest prices
-            for time, low in lowest_2:
-                day_entry += f"  {date} - {time} : {low:.8f}\n"
+            for label, index in zip(labels[:len(lowest_2)], lowest_2):
+                day_entry += f"  {label} : {lows[index]:.8f}\n"
             
             day_entry += "  .....\n"
             
             # Add 2 highest prices
-            for time, high in highest_2:
-                day_entry += f"  {date} - {time} : {high:.8f}\n"
+            for label, index in zip(labels[len(lowest_2):], highest_2):
+                day_entry += f"  {label} : {lows[index]:.8f}\n"
             
             day_entry += f"  Tỷ lệ Cao/Thấp: {ratio:.4f}\n\n"
             
             result_message += day_entry
 
-        # Split long message and send multiple messages if needed
-        split_messages = split_long_message(result_message)
-        for msg in split_messages:
-            bot.reply_to(message, msg)
+        # Outbox tự chia tin dài thành nhiều tin
+        outbox.reply_to(message, result_message)
 
     except Exception as e:
-        bot.reply_to(message, f"Đã xảy ra lỗi: {str(e)}")
+        outbox.reply_to(message, f"Đã xảy ra lỗi: {str(e)}")
+
+@bot.message_handler(commands=['scan'])
+def scan_command(message):
+    try:
+        command_parts = message.text.split()
+        top_k = market_scanner.SCAN_TOP_K
+        if len(command_parts) > 1:
+            try:
+                top_k = int(command_parts[1])
+                if top_k <= 0:
+                    raise ValueError
+            except ValueError:
+                outbox.reply_to(message, "Cú pháp không đúng. Vui lòng nhập: /scan [số symbol], ví dụ /scan 20")
+                return
+        top_k = min(top_k, market_scanner.SCAN_MAX_TOP_K)
+
+        # Một request /ticker/24hr cho cả thị trường, klines 5m chỉ cho các ứng viên đứng đầu
+        scan = market_scanner.scan_market(top_k)
+        if not scan['results']:
+            outbox.reply_to(message, f"Không tìm thấy cặp {market_scanner.SCAN_QUOTE_ASSET} nào phù hợp.")
+            return
+
+        utc_tz = timezone('UTC')
+        result_message = f"**** Market scan at {datetime.now(utc_tz).strftime('%H:%M - %d.%m.%y')} UTC ****\n\n"
+        for rank, result in enumerate(scan['results'], 1):
+            result_message += f"{rank}) {result['symbol']}:\n"
+            result_message += f"  Tỉ lệ Cao/Thấp: {result['ratio']:.4f}\n"
+            result_message += f"  24h: {result['change']:+.2f}%, khối lượng {result['quote_volume']:,.0f} {market_scanner.SCAN_QUOTE_ASSET}\n\n"
+
+        result_message += f"Đã quét {scan['pairs']} cặp, lấy nến của {scan['fetched']} cặp ({scan['requests']} request)."
+        if not scan['exact']:
+            result_message += "\nChỉ lấy nến của các cặp có biên độ 24h lớn nhất, thứ hạng có thể bỏ sót cặp khác."
+        outbox.reply_to(message, result_message)
+
+    except Exception as e:
+        outbox.reply_to(message, f"Đã xảy ra lỗi: {str(e)}")
 
 def get_historical_data(symbol, days):
     try:
@@ -436,281 +480,423 @@ def get_historical_data(symbol, days):
         # Thời điểm bắt đầu (n-1 ngày trước, tính từ đầu ngày)
         start_time = current_time_utc.replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(days=days - 1)
 
-        # Số ngày trong mỗi chunk
-        days_per_chunk = 3
+        # Lấy nến từ kline_store dưới dạng Candles (cột numpy), định dạng thời gian để lúc hiển thị
+        try:
+            return kline_store.get_candles(
+                symbol, '5m',
+                int(start_time.timestamp() * 1000),
+                int(current_time_utc.timestamp() * 1000)
+            )
+        except ValueError:
+            return {'error': f"Vui lòng kiểm tra lại tên symbol: " + symbol}
 
-        # Tính số chunks cần thiết
-        num_chunks = math.ceil(days / days_per_chunk)
+    except Exception as e:
+        return {'error': str(e)}
 
-        all_data = []
+def reset_daily_ratios(current_time_utc):
+    # Reset toàn bộ ratios của mọi chat về 1.0
+    tracking_time = current_time_utc.strftime('%d.%m.%y - %H:%M')
+    for chat_id, coins in chat_registry.symbols_by_chat().items():
+        previous_ratios = {symbol: {'ratio': 1.0, 'tracking_time': tracking_time} for symbol in coins}
+        ratio_store.replace(chat_id, previous_ratios)
+        outbox.send(chat_id, "Thời gian mốc 00:00, toàn bộ symbol trả về 1.0!!!!", parse_mode='Markdown')
 
-        # Lặp qua từng chunk để lấy dữ liệu
-        for i in range(num_chunks):
-            if i == 0:
-                chunk_end = current_time_utc
-            else:
-                days_back = i * days_per_chunk
-                chunk_end = current_time_utc.replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(days=days_back - 1)
+def union_symbols(symbols_by_chat):
+    # Mỗi symbol chỉ lấy dữ liệu một lần dù nhiều chat cùng theo dõi
+    return list(dict.fromkeys(symbol for coins in symbols_by_chat.values() for symbol in coins))
 
-            if i == num_chunks - 1:
-                chunk_start = start_time
-            else:
-                chunk_start = chunk_end - timedelta(days=days_per_chunk)
+def check_coin_limits():
+    symbols_by_chat = chat_registry.symbols_by_chat()
+    if not symbols_by_chat:
+        return  # Exit if no chat
 
-            params = {
-                'symbol': symbol,
-                'interval': '5m',
-                'startTime': int(chunk_start.timestamp() * 1000),
-                'endTime': int(chunk_end.timestamp() * 1000),
-                'limit': 1000
-            }
+    coins = union_symbols(symbols_by_chat)
+    utc_tz = timezone('UTC')
+    current_time_utc = datetime.now(utc_tz)
+    
+    chunk_start = current_time_utc.replace(hour=0, minute=0, second=0, microsecond=0)
+    chunk_end = current_time_utc
 
-            response = fetch_binance_data(f"{BASE_URL}/klines", params=params)
-            klines = response.json()
+    # Chỉ lấy các nến mới hơn nến đã đóng cuối cùng của mỗi symbol (state reset khi sang ngày UTC mới)
+    day_start = int(chunk_start.timestamp() * 1000)
+    now_ms = int(chunk_end.timestamp() * 1000)
+    start_times = {symbol: intraday_tracker.fetch_start(symbol, day_start) for symbol in coins}
+
+    fetch_started = time.perf_counter()
+    # Lấy klines song song, thời gian mỗi tick ~ request chậm nhất thay vì tổng các request;
+    # có thể chia lô và rải đều trong FETCH_STAGGER_WINDOW giây để giảm tải đột biến
+    klines_by_symbol = {}
+    for batch in staggered(coins, FETCH_BATCH_SIZE, FETCH_STAGGER_WINDOW):
+        klines_by_symbol.update(fetch_klines_concurrently(batch, chunk_start, chunk_end, start_times=start_times))
+    SCAN_PHASE.observe(time.perf_counter() - fetch_started, phase='fetch')
+
+    parse_started = time.perf_counter()
+    extremes_by_symbol = {}
+    for symbol in coins:
+        data = klines_by_symbol.get(symbol)
+        if not data:
+            continue
 
-            for kline in klines:
-                try:
-                    open_time = datetime.fromtimestamp(int(float(kline[0])) / 1000, tz=utc_tz)
-                except ValueError:
-                    return {'error': f"Vui lòng kiểm tra lại tên symbol: " + symbol}
+        try:
+            extremes = intraday_tracker.update(symbol, data, day_start, now_ms)
+        except ValueError:
+            print(f"Error converting data to float for {symbol}")
+            continue
 
-                formatted_time = open_time.strftime('%d.%m.%y - %H:%M')
-                formatted_kline = [formatted_time] + kline[1:]
-                all_data.append(formatted_kline)
+        if extremes is not None:
+            extremes_by_symbol[symbol] = extremes
 
-            if i < num_chunks - 1:
-                time.sleep(0.1)
+    SCAN_PHASE.observe(time.perf_counter() - parse_started, phase='parse')
 
-        all_data.sort(key=lambda x: datetime.strptime(x[0], '%d.%m.%y - %H:%M'))
-        return all_data
+    evaluate_coin_limits(symbols_by_chat, extremes_by_symbol)
 
-    except Exception as e:
-        return {'error': str(e)}
+def evaluate_coin_limits(symbols_by_chat, extremes_by_symbol):
+    """
+    Compute each symbol's intraday high/low ratio once, then for every chat
+    compare it with that chat's previous_ratios and send the alert when at
+    least one ratio rose by the chat's threshold or more.
+    extremes_by_symbol maps symbol -> (lowest_2, highest_2) of (open_time, low).
+    """
+    evaluate_started = time.perf_counter()
+    utc_tz = timezone('UTC')
+    reports = {}  # symbol -> (ratio, các dòng giá trong cảnh báo), dùng chung cho mọi chat
 
-def check_coin_limits():
-    global USER_CHAT_ID
-    if USER_CHAT_ID is None:
-        return  # Exit if no chat_id
+    for symbol in union_symbols(symbols_by_chat):
+        extremes = extremes_by_symbol.get(symbol)
+        if extremes is None:
+            continue
 
-    coins = read_coin_list()
-    utc_tz = timezone('UTC')
-    current_time_utc = datetime.now(utc_tz)
-    
-	# Kiểm tra nếu là đúng 00:00 UTC
-    if current_time_utc.hour == 0 and current_time_utc.minute == 0 and current_time_utc.second == 5:
-        # Reset toàn bộ ratios về 1.0
-        previous_ratios = {symbol: {'ratio': 1.0, 'tracking_time': current_time_utc.strftime('%d.%m.%y - %H:%M')} for symbol in read_coin_list()}
-        save_previous_ratios(previous_ratios)
-        bot.send_message(chat_id=USER_CHAT_ID, text="Thời gian mốc 00:00, toàn bộ symbol trả về 1.0!!!!", parse_mode='Markdown')
-        return
-    
-    chunk_start = current_time_utc.replace(hour=0, minute=0, second=0, microsecond=0)
-    chunk_end = current_time_utc
+        try:
+            # Đổi open_time sang chuỗi thời gian để hiển thị
+            lowest_2, highest_2 = [
+                [[datetime.fromtimestamp(open_time / 1000, tz=utc_tz).strftime('%d.%m.%y - %H:%M'), low] for open_time, low in records]
+                for records in extremes
+            ]
+
+            # Calculate limits
+            lowest_price = lowest_2[0][1]
+            highest_price = highest_2[-1][1]
+            
+            # Calculate ratio
+            ratio = highest_price / lowest_price
+            
+            # Combine and sort by time
+            combined_records = sorted(lowest_2 + highest_2, key=lambda x: x[1])
+            
+            price_lines = ""
+            for i, (candle_time, low) in enumerate(combined_records):
+                if i == 2:
+                    price_lines += "  ...\n"
+                price_lines += f"  {candle_time} : {low:.8f}\n"
+
+            reports[symbol] = (ratio, price_lines)
+
+        except Exception as e:
+            print(f"Error checking {symbol}: {e}")
 
+    tracking_time = datetime.now(utc_tz).strftime('%d.%m.%y - %H:%M')
+    alerts_by_chat = {}
+    for chat_id, coins in symbols_by_chat.items():
+        alert_messages = evaluate_chat_limits(chat_id, coins, reports, tracking_time)
+        if alert_messages:
+            alerts_by_chat[chat_id] = alert_messages
+    SCAN_PHASE.observe(time.perf_counter() - evaluate_started, phase='evaluate')
+
+    send_started = time.perf_counter()
+    for chat_id, alert_messages in alerts_by_chat.items():
+        send_chat_alert(chat_id, alert_messages)
+    SCAN_PHASE.observe(time.perf_counter() - send_started, phase='send')
+
+def evaluate_chat_limits(chat_id, coins, reports, tracking_time):
+    # Trả về các mục cảnh báo của chat nếu có ít nhất một tỉ lệ tăng đủ ngưỡng, ngược lại trả về []
     alert_messages = []  # List to store messages
-    previous_ratios = load_previous_ratios()
-    current_ratios = {}
+    previous_ratios = ratio_store.snapshot(chat_id)
+    changed_ratios = {}  # Chỉ các symbol có previous_ratios thay đổi
+    threshold = chat_registry.threshold(chat_id)
     has_significant_increase = False
 
     for symbol in coins:
-        try:
-            params = {
-                'symbol': symbol,
-                'interval': '5m',
-                'startTime': int(chunk_start.timestamp() * 1000),
-                'endTime': int(chunk_end.timestamp() * 1000),
-                'limit': 500
-            }
-            response = fetch_binance_data(f"{BASE_URL}/klines", params=params)
-            data = response.json()
+        report = reports.get(symbol)
+        if report is None:
+            continue
 
-            if response.status_code != 200 or not data or not isinstance(data, list):
-                continue
+        ratio, price_lines = report
+        current_ratio = {'ratio': ratio, 'tracking_time': tracking_time}
 
-            try:
-                formatted_data = []
-                for kline in data:
-                    open_time = datetime.fromtimestamp(int(float(kline[0])) / 1000, tz=utc_tz)
-                    formatted_time = open_time.strftime('%d.%m.%y - %H:%M')
-                    low_price = float(kline[3])  # Lowest price
-                    formatted_kline = [formatted_time, low_price]
-                    formatted_data.append(formatted_kline)
-
-                # Sort by low price and get 2 lowest and 2 highest
-                formatted_data.sort(key=lambda x: x[1])
-                
-                lowest_2 = formatted_data[:2]
-                highest_2 = formatted_data[-2:]
-
-                # Calculate limits
-                lowest_price = lowest_2[0][1]
-                highest_price = highest_2[-1][1]
-                
-                # Calculate and track ratio
-                ratio = highest_price / lowest_price
-                current_ratios[symbol] = {
-                    'ratio': ratio,
-                    'tracking_time': datetime.now(utc_tz).strftime('%d.%m.%y - %H:%M')
-                }
-                
-                # Create message for this symbol
-                alert_message = f"{symbol}:\n"
-                
-                # Combine and sort by time
-                combined_records = sorted(lowest_2 + highest_2, key=lambda x: x[1])
-                
-                for i, (time, low) in enumerate(combined_records):
-                    if i == 2:
-                        alert_message += "  ...\n"
-                    alert_message += f"  {time} : {low:.8f}\n"
-
-                # Kiểm tra và format ratio
-                if symbol not in previous_ratios:
-                    # Nếu symbol chưa từng có trong previous_ratios
-                    alert_message += f"\n  Tỉ lệ Cao/Thấp: {ratio:.4f}\n"
-                    previous_ratios[symbol] = current_ratios[symbol]
-                else:
-                    # Nếu symbol đã có trong previous_ratios
-                    prev_data = previous_ratios[symbol]
-                    prev_ratio = prev_data['ratio']
-
-                    # Determine if the ratio has increased
-                    is_increased = ratio >= (prev_ratio + 0.01)
-
-                    ratio_change = (ratio - prev_ratio) / prev_ratio * 100
-                    print(f'{symbol} : {ratio} ({ratio_change}%)')
-                    
-                    if is_increased:
-                        alert_message += f"\n  Tỉ lệ Cao/Thấp: 🟢 {ratio:.4f} (+{ratio_change:.2f}%)\n"
-                        has_significant_increase = True
-                        previous_ratios[symbol] = current_ratios[symbol]
-                    else:
-                        alert_message += f"\n  Tỉ lệ Cao/Thấp: {ratio:.4f}\n"
-
-                alert_message += "------------------------------"
-                
-                # Thêm thông tin ratio vào message để dễ sắp xếp
-                alert_messages.append({
-                    'message': alert_message, 
-                    'ratio': ratio
-                })
+        # Create message for this symbol
+        alert_message = f"{symbol}:\n" + price_lines
 
-            except ValueError:
-                print(f"Error converting data to float for {symbol}")
-                continue
+        # Kiểm tra và format ratio
+        if symbol not in previous_ratios:
+            # Nếu symbol chưa từng có trong previous_ratios
+            alert_message += f"\n  Tỉ lệ Cao/Thấp: {ratio:.4f}\n"
+            previous_ratios[symbol] = changed_ratios[symbol] = current_ratio
+        else:
+            # Nếu symbol đã có trong previous_ratios
+            prev_data = previous_ratios[symbol]
+            prev_ratio = prev_data['ratio']
 
-        except Exception as e:
-            print(f"Error checking {symbol}: {e}")
+            # Determine if the ratio has increased
+            is_increased = ratio >= (prev_ratio + threshold)
+
+            ratio_change = (ratio - prev_ratio) / prev_ratio * 100
+            print(f'{chat_id} {symbol} : {ratio} ({ratio_change}%)')
+            
+            if is_increased:
+                alert_message += f"\n  Tỉ lệ Cao/Thấp: 🟢 {ratio:.4f} (+{ratio_change:.2f}%)\n"
+                has_significant_increase = True
+                previous_ratios[symbol] = changed_ratios[symbol] = current_ratio
+            else:
+                alert_message += f"\n  Tỉ lệ Cao/Thấp: {ratio:.4f}\n"
+
+        alert_message += "------------------------------"
+        
+        # Thêm thông tin ratio vào message để dễ sắp xếp
+        alert_messages.append({
+            'message': alert_message, 
+            'ratio': ratio
+        })
 
     # Lưu lại previous_ratios với các coin đã thay đổi
-    save_previous_ratios(previous_ratios)
+    ratio_store.update(chat_id, changed_ratios)
 
-    # Chỉ lưu và gửi thông báo nếu có sự thay đổi
+    # Chỉ gửi thông báo nếu có sự thay đổi
     if has_significant_increase and alert_messages:
-        # Sắp xếp messages theo ratio giảm dần
-        sorted_messages = sorted(alert_messages, key=lambda x: x['ratio'], reverse=True)
+        return alert_messages
+    return []
 
-        full_alert = f"****** Automatic Telegram Bot Message ******\n"
-        full_alert += f"Monitoring data at {datetime.now(utc_tz).strftime('%H:%M - %d.%m.%y')} UTC:\n\n"
-        current_message = full_alert
-        
-        # Thêm index sau khi sắp xếp
-        for index, item in enumerate(sorted_messages, 1):
-            message = f"{index}) " + item['message']
-            if len(current_message) + len(message) > 4000:
-                bot.send_message(chat_id=USER_CHAT_ID, text=current_message, parse_mode='Markdown')
-                current_message = full_alert
+def send_chat_alert(chat_id, alert_messages):
+    utc_tz = timezone('UTC')
+
+    # Sắp xếp messages theo ratio giảm dần
+    sorted_messages = sorted(alert_messages, key=lambda x: x['ratio'], reverse=True)
+
+    full_alert = f"****** Automatic Telegram Bot Message ******\n"
+    full_alert += f"Monitoring data at {datetime.now(utc_tz).strftime('%H:%M - %d.%m.%y')} UTC:\n\n"
+    current_message = full_alert
+    
+    # Thêm index sau khi sắp xếp
+    for index, item in enumerate(sorted_messages, 1):
+        message = f"{index}) " + item['message']
+        if len(current_message) + len(message) > 4000:
+            outbox.send(chat_id, current_message, parse_mode='Markdown')
+            current_message = full_alert
 
-            current_message += message + "\n"
+        current_message += message + "\n"
 
-        if current_message.strip():
-            bot.send_message(chat_id=USER_CHAT_ID, text=current_message, parse_mode='Markdown')
+    if current_message.strip():
+        outbox.send(chat_id, current_message, parse_mode='Markdown')
 
 TIME_SET = [5, 'm']
 
-def run_schedule():
-    while True:
-        if is_connected():
-            now = datetime.now()
-            if TIME_SET[1] == 's':
-                # Gửi liên tục sau mỗi khoảng thời gian được định nghĩa.
-                interval_seconds = TIME_SET[0]
-                next_run_time = now + timedelta(seconds=interval_seconds)
-                wait_time = interval_seconds
-            elif TIME_SET[1] == 'm':
-                # Gửi ở giây thứ 10 của mỗi bước nhảy phút.
-                interval_minutes = TIME_SET[0]
-                
-                # Calculate the next minute to run
-                next_minute = ((now.minute // interval_minutes) + 1) * interval_minutes
-                
-                # Handle rollover to next hour if needed
-                if next_minute >= 60:
-                    next_minute = next_minute % 60
-                    next_run_time = (now + timedelta(hours=1)).replace(
-                        minute=next_minute,
-                        second=5, 
-                        microsecond=0
-                    )
-                else:
-                    next_run_time = now.replace(
-                        minute=next_minute,
-                        second=5, 
-                        microsecond=0
-                    )
-                
-                # Nếu thời gian hiện tại đã qua thời gian tính toán, chuyển sang lần tiếp theo.
-                if now >= next_run_time:
-                    next_run_time += timedelta(minutes=interval_minutes)
-                
-                wait_time = (next_run_time - now).total_seconds()
-
-            print(f"Đợi {wait_time:.2f} giây đến lần chạy tiếp theo lúc {next_run_time.strftime('%H:%M:%S')}.")
-
-            time.sleep(wait_time)
-            check_coin_limits()
-        else:
-            print("Mất mạng, chờ kết nối lại...")
-            time.sleep(5)
+def scheduled_tick(slot_time):
+    if not binance_available():
+        print("Mất mạng, bỏ qua lượt này...")
+        return
+    with SCAN_TICK.time():
+        check_coin_limits()
+
+def scheduled_day_reset(slot_time):
+    # Chạy đúng một lần mỗi ngày UTC, kể cả khi lượt 00:00 bị trễ hoặc bị bỏ qua
+    reset_daily_ratios(datetime.fromtimestamp(slot_time, tz=timezone('UTC')))
+
+def create_scheduler():
+    if TIME_SET[1] == 's':
+        # Chạy liên tục sau mỗi khoảng thời gian được định nghĩa.
+        interval, offset = TIME_SET[0], 0
+    else:
+        # Chạy ở giây thứ 5 của mỗi bước nhảy phút.
+        interval, offset = TIME_SET[0] * 60, 5
+    return AlignedScheduler(interval, scheduled_tick, offset=offset, day_job=scheduled_day_reset, overrun=SCHEDULE_OVERRUN)
+
+def collect_bot_metrics():
+    OUTBOX_PENDING.set(outbox.pending())
+    SUBSCRIBED_CHATS.set(len(chat_registry.chats()))
+    WATCHED_SYMBOLS.set(len(chat_registry.all_symbols()))
+    if tick_scheduler is not None:
+        stats = tick_scheduler.stats()
+        SCAN_OVERRUNS.set(stats['overruns'])
+        SCAN_SKIPPED.set(stats['skipped'])
+        if stats['last'] is not None:
+            SCAN_TICK_LAG.set(stats['last']['lag'])
+
+metrics.REGISTRY.add_collector(collect_bot_metrics)
+
+def start_metrics_server():
+    if not BOT_METRICS_PORT:
+        return
+    try:
+        metrics.start_http_server(BOT_METRICS_PORT, BOT_METRICS_HOST)
+    except OSError as e:
+        # Cổng đã bị chiếm hoặc không có quyền: bot vẫn chạy, chỉ không có /metrics
+        print(f"Không mở được metrics trên {BOT_METRICS_HOST}:{BOT_METRICS_PORT}: {e}")
+        return
+    print(f"Metrics: http://{BOT_METRICS_HOST}:{BOT_METRICS_PORT}/metrics")
 
 def start_telegram_bot():
     def polling():
+        # Không kiểm tra mạng trước: lỗi của chính bot.polling quyết định thời gian chờ (backoff lũy thừa)
+        retry_delay = POLLING_RETRY_DELAY
         while True:
-            if is_connected():
-                try:
-                    print("Đang khởi động bot...")
-                    bot.polling(non_stop=True, interval=0)
-                    print("Bot đang chạy!")
-                    break  # Thoát khỏi vòng lặp khi polling thành công
-                except Exception as e:
-                    print(f"Lỗi bot.polling: {e}. Thử lại sau...")
-                    time.sleep(5)
-            else:
-                print("Mất mạng, chờ kết nối lại...")
-                time.sleep(5)
+            try:
+                print("Đang khởi động bot...")
+                bot.polling(non_stop=True, interval=0)
+                print("Bot đang chạy!")
+                break  # Thoát khỏi vòng lặp khi polling thành công
+            except Exception as e:
+                print(f"Lỗi bot.polling: {e}. Thử lại sau {retry_delay} giây...")
+                time.sleep(retry_delay)
+                retry_delay = min(retry_delay * 2, POLLING_MAX_RETRY_DELAY)
 
     # Chạy polling trong một luồng riêng
     bot_thread = threading.Thread(target=polling, daemon=True)
     bot_thread.start()
             
-def fetch_binance_data(url, params):
-    while True:
-        if is_connected():
-            try:
-                response = requests.get(url, params=params)
-                response.raise_for_status()  # Kiểm tra lỗi HTTP
-                return response
-            except Exception as e:
-                print(f"Lỗi API Binance: {e}")
-                break
-        else:
-            print("Mất mạng, chờ kết nối lại...")
-            time.sleep(5)
+def fetch_binance_data(path, params):
+    try:
+        # Dùng session keep-alive chung (pool, timeout, retry, circuit breaker) trong binance_client;
+        # khi mất mạng request bị từ chối ngay thay vì gọi tiếp lên API
+        response = binance_client.get(path, params=params)
+        response.raise_for_status()  # Kiểm tra lỗi HTTP
+        return response
+    except Exception as e:
+        print(f"Lỗi API Binance: {e}")
+
+def fetch_klines_concurrently(symbols, start_time, end_time, interval='5m', start_times=None):
+    """
+    Fetch klines for many symbols in parallel, bounded by FETCH_CONCURRENCY.
+    start_times optionally overrides start_time per symbol (in ms).
+    Returns {symbol: list of klines}; symbols that failed map to None.
+    """
+    def fetch_one(symbol):
+        try:
+            if start_times and symbol in start_times:
+                start_ms = start_times[symbol]
+            else:
+                start_ms = int(start_time.timestamp() * 1000)
+            params = {
+                'symbol': symbol,
+                'interval': interval,
+                'startTime': start_ms,
+                'endTime': int(end_time.timestamp() * 1000),
+                'limit': 500
+            }
+            response = fetch_binance_data('/klines', params=params)
+            data = response.json()
+
+            if response.status_code != 200 or not data or not isinstance(data, list):
+                return None
+            return data
+        except Exception as e:
+            print(f"Lỗi khi lấy dữ liệu {symbol}: {e}")
+            return None
+
+    if not symbols:
+        return {}
+
+    max_workers = max(1, min(FETCH_CONCURRENCY, len(symbols)))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = executor.map(fetch_one, symbols)
+        return dict(zip(symbols, results))
 
 def start_schedule():
-    schedule_thread = threading.Thread(target=run_schedule)
-    schedule_thread.start()
+    global tick_scheduler
+    tick_scheduler = create_scheduler()
+    tick_scheduler.start()
+
+_stream_evaluate_timer = None
+_stream_lock = threading.Lock()
+_last_evaluated_day = None
+
+def on_stream_kline_closed(symbol, kline):
+    try:
+        open_time = int(kline[0])
+        day_ms = kline_store.INTERVAL_MS['1d']
+        day_start = open_time // day_ms * day_ms
+
+        # Bị thiếu nến (vừa kết nối lại hoặc vừa thêm coin): lấy bù qua REST
+        klines = [kline]
+        fetch_start = intraday_tracker.fetch_start(symbol, day_start)
+        if fetch_start < open_time:
+            params = {
+                'symbol': symbol,
+                'interval': '5m',
+                'startTime': fetch_start,
+                'endTime': open_time - 1,
+                'limit': 500
+            }
+            response = fetch_binance_data('/klines', params=params)
+            if response is not None and response.status_code == 200:
+                klines = response.json() + klines
+
+        intraday_tracker.update(symbol, klines, day_start, int(kline[6]) + 1)
+        schedule_stream_evaluation()
+    except Exception as e:
+        print(f"Lỗi khi xử lý nến {symbol}: {e}")
+
+def schedule_stream_evaluation():
+    global _stream_evaluate_timer
+    with _stream_lock:
+        if _stream_evaluate_timer is None:
+            _stream_evaluate_timer = threading.Timer(STREAM_EVALUATE_DELAY, evaluate_stream)
+            _stream_evaluate_timer.daemon = True
+            _stream_evaluate_timer.start()
+
+def evaluate_stream():
+    global _stream_evaluate_timer, _last_evaluated_day
+    with _stream_lock:
+        _stream_evaluate_timer = None
+
+    symbols_by_chat = chat_registry.symbols_by_chat()
+    if not symbols_by_chat:
+        return
+
+    utc_tz = timezone('UTC')
+    current_time_utc = datetime.now(utc_tz)
+    day_start = int(current_time_utc.replace(hour=0, minute=0, second=0, microsecond=0).timestamp() * 1000)
+
+    # Lần đánh giá đầu tiên của ngày mới: reset toàn bộ ratios như chế độ poll
+    if _last_evaluated_day is not None and day_start != _last_evaluated_day:
+        _last_evaluated_day = day_start
+        reset_daily_ratios(current_time_utc)
+        return
+    _last_evaluated_day = day_start
+
+    coins = union_symbols(symbols_by_chat)
+    now_ms = int(current_time_utc.timestamp() * 1000)
+    extremes_by_symbol = {}
+    for symbol in coins:
+        extremes = intraday_tracker.update(symbol, [], day_start, now_ms)
+        if extremes is not None:
+            extremes_by_symbol[symbol] = extremes
+
+    evaluate_coin_limits(symbols_by_chat, extremes_by_symbol)
+
+def start_kline_stream():
+    global kline_stream_client
+    kline_stream_client = KlineStream(chat_registry.all_symbols(), on_stream_kline_closed, interval='5m')
+    kline_stream_client.start()
+
+def shutdown(signum, frame):
+    # atexit không chạy khi bị SIGTERM (docker stop, systemd): ghi previous_ratios trước khi thoát
+    print(f"Nhận {signal.Signals(signum).name}, đang dừng bot...")
+    if tick_scheduler is not None:
+        tick_scheduler.stop()
+    if kline_stream_client is not None:
+        kline_stream_client.stop()
+    ratio_store.close()
+    # Luồng scheduler/stream không phải daemon và có thể đang giữa một lượt quét: thoát ngay
+    os._exit(0)
+
+def install_signal_handlers():
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, shutdown)
 
 if __name__ == '__main__':
+    install_signal_handlers()
+    start_metrics_server()
     start_telegram_bot()
-    start_schedule()
\ No newline at end of file
+    if BOT_MODE == 'stream':
+        start_kline_stream()
+    else:
+        start_schedule()
\ No newline at end of file
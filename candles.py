@@ -0,0 +1,146 @@
+import numpy as np
+
+DAY_MS = 24 * 60 * 60 * 1000
+
+class Candles:
+    """
+    Columnar candle container with the columns of a Binance kline: int64
+    open_time/close_time in ms and trades, float64 prices and volumes, kept
+    sorted by open_time. Time strings are only produced at the output edge
+    by format_times().
+    """
+
+    __slots__ = (
+        'open_time', 'open', 'high', 'low', 'close', 'volume',
+        'close_time', 'quote_volume', 'trades', 'taker_base_volume', 'taker_quote_volume'
+    )
+    INT_COLUMNS = ('open_time', 'close_time', 'trades')
+
+    def __init__(self, open_time, open, high, low, close, volume,
+                 close_time, quote_volume, trades, taker_base_volume, taker_quote_volume):
+        self.open_time = open_time
+        self.open = open
+        self.high = high
+        self.low = low
+        self.close = close
+        self.volume = volume
+        self.close_time = close_time
+        self.quote_volume = quote_volume
+        self.trades = trades
+        self.taker_base_volume = taker_base_volume
+        self.taker_quote_volume = taker_quote_volume
+
+    @classmethod
+    def empty(cls):
+        return cls(*(np.empty(0, dtype=np.int64 if name in cls.INT_COLUMNS else np.float64) for name in cls.__slots__))
+
+    @classmethod
+    def from_table(cls, table):
+        # table: mảng float64 n x 11 theo thứ tự cột của Binance (bỏ cột 'ignore')
+        return cls(*(
+            table[:, index].astype(np.int64) if name in cls.INT_COLUMNS else table[:, index].copy()
+            for index, name in enumerate(cls.__slots__)
+        ))
+
+    @classmethod
+    def from_klines(cls, klines):
+        # klines: các hàng dạng Binance [open_time, open, high, low, close, volume, close_time, ...], giá có thể là chuỗi
+        if not klines:
+            return cls.empty()
+        open_time = np.fromiter((kline[0] for kline in klines), dtype=np.int64, count=len(klines))
+        values = cls.from_table(np.array([kline[:11] for kline in klines], dtype=np.float64))
+        values.open_time = open_time  # giữ nguyên int, không đi qua float
+        return values.sorted()
+
+    @classmethod
+    def concat(cls, parts):
+        # Gộp nhiều phần và sắp xếp theo open_time; trùng open_time thì giữ bản sau cùng (nến mới cập nhật)
+        parts = [part for part in parts if len(part)]
+        if not parts:
+            return cls.empty()
+        merged = cls(*(np.concatenate([getattr(part, name) for part in parts]) for name in cls.__slots__))
+        return merged.sorted()
+
+    def sorted(self):
+        order = np.argsort(self.open_time, kind='stable')
+        open_time = self.open_time[order]
+        keep = np.ones(len(open_time), dtype=bool)
+        keep[:-1] = open_time[1:] != open_time[:-1]
+        index = order[keep]
+        return Candles(*(getattr(self, name)[index] for name in self.__slots__))
+
+    def __len__(self):
+        return len(self.open_time)
+
+    def __getitem__(self, index):
+        return Candles(*(getattr(self, name)[index] for name in self.__slots__))
+
+    def downsample(self, max_points):
+        """
+        Aggregate consecutive candles into at most max_points buckets, keeping
+        the shape: first open, max high, min low, last close, summed volume,
+        and the open_time of the bucket's first candle.
+        """
+        count = len(self)
+        if max_points <= 0 or count <= max_points:
+            return self
+
+        bucket_size = -(-count // max_points)  # ceil
+        starts = np.arange(0, count, bucket_size)
+        ends = np.r_[starts[1:], count] - 1
+        return Candles(
+            self.open_time[starts],
+            self.open[starts],
+            np.maximum.reduceat(self.high, starts),
+            np.minimum.reduceat(self.low, starts),
+            self.close[ends],
+            np.add.reduceat(self.volume, starts),
+            self.close_time[ends],
+            np.add.reduceat(self.quote_volume, starts),
+            np.add.reduceat(self.trades, starts),
+            np.add.reduceat(self.taker_base_volume, starts),
+            np.add.reduceat(self.taker_quote_volume, starts)
+        )
+
+    def day_slices(self):
+        # Chia theo ngày UTC, trả về [(day_start_ms, slice)] theo thứ tự thời gian
+        if not len(self):
+            return []
+        days = self.open_time // DAY_MS
+        starts = np.flatnonzero(np.r_[True, days[1:] != days[:-1]])
+        ends = np.r_[starts[1:], len(days)]
+        return [(int(days[start]) * DAY_MS, slice(int(start), int(end))) for start, end in zip(starts, ends)]
+
+    def format_times(self):
+        # Định dạng 'dd.mm.yy - HH:MM' (UTC) dùng trong toàn bộ app/bot
+        iso = np.datetime_as_string(self.open_time.astype('datetime64[ms]'), unit='m')
+        return [f"{s[8:10]}.{s[5:7]}.{s[2:4]} - {s[11:16]}" for s in iso]
+
+    def to_columns(self):
+        # Dạng cột: mỗi trường là một mảng số, open_time giữ nguyên ms
+        return {
+            'open_time': self.open_time.tolist(),
+            'open': self.open.tolist(),
+            'high': self.high.tolist(),
+            'low': self.low.tolist(),
+            'close': self.close.tolist(),
+            'volume': self.volume.tolist()
+        }
+
+    def to_bytes(self):
+        # Nhị phân: mỗi nến 6 số float64 little-endian [open_time, open, high, low, close, volume],
+        # trình duyệt đọc thẳng bằng Float64Array; nối nhiều trang liên tiếp vẫn hợp lệ
+        table = np.column_stack((self.open_time.astype(np.float64), self.open, self.high, self.low, self.close, self.volume))
+        return table.astype('<f8').tobytes()
+
+    def to_rows(self):
+        # Hàng đúng bố cục klines của Binance (giá/khối lượng là chuỗi 8 chữ số thập phân, cột cuối 'ignore'),
+        # chỉ thay open_time bằng thời gian đã định dạng
+        def decimals(column):
+            return [f'{value:.8f}' for value in column.tolist()]
+
+        return [list(row) + ['0'] for row in zip(
+            self.format_times(), decimals(self.open), decimals(self.high), decimals(self.low),
+            decimals(self.close), decimals(self.volume), self.close_time.tolist(), decimals(self.quote_volume),
+            self.trades.tolist(), decimals(self.taker_base_volume), decimals(self.taker_quote_volume)
+        )]
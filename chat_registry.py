@@ -0,0 +1,117 @@
+import json
+import os
+import threading
+from atomic_file import atomic_write
+from watchlist import Watchlist
+
+class ChatRegistry:
+    """
+    Chats subscribed to alerts, each with its own Watchlist file and alert
+    threshold. The scanner works on the union of all watchlists so every
+    symbol is fetched once per tick no matter how many chats watch it.
+    on_change(symbols) runs with the new union whenever a watchlist changes,
+    once per symbols_by_chat() pass however many watchlists changed in it.
+    """
+
+    def __init__(self, path, checklist_dir, default_threshold=0.01, legacy_checklist=None, on_change=None):
+        self.path = path
+        self.checklist_dir = checklist_dir
+        self.default_threshold = default_threshold
+        # checklist.txt của bản một chat: chat đầu tiên đăng ký sẽ dùng lại file này
+        self.legacy_checklist = legacy_checklist
+        self.on_change = on_change
+        self._chats = self._load()  # chat_id -> {'checklist': path, 'threshold': float}
+        self._watchlists = {}
+        self._lock = threading.Lock()
+        # Theo từng luồng: đang trong lượt symbols_by_chat() (độ sâu) và có watchlist thay đổi chưa báo
+        self._local = threading.local()
+
+    def _load(self):
+        if os.path.exists(self.path):
+            with open(self.path, 'r') as f:
+                try:
+                    return {int(chat_id): settings for chat_id, settings in json.load(f).items()}
+                except (json.JSONDecodeError, ValueError):
+                    return {}
+        return {}
+
+    def _persist(self):
+        data = {str(chat_id): settings for chat_id, settings in self._chats.items()}
+        atomic_write(self.path, json.dumps(data, indent=2), prefix='.chats-')
+
+    def register(self, chat_id):
+        # Trả về True nếu là chat mới
+        with self._lock:
+            if chat_id in self._chats:
+                return False
+            if not self._chats and self.legacy_checklist and os.path.exists(self.legacy_checklist):
+                checklist = self.legacy_checklist
+            else:
+                os.makedirs(self.checklist_dir, exist_ok=True)
+                checklist = os.path.join(self.checklist_dir, f'{chat_id}.txt')
+            self._chats[chat_id] = {'checklist': checklist, 'threshold': self.default_threshold}
+            self._persist()
+        return True
+
+    def is_legacy(self, chat_id):
+        with self._lock:
+            settings = self._chats.get(chat_id)
+            return settings is not None and settings['checklist'] == self.legacy_checklist
+
+    def chats(self):
+        with self._lock:
+            return list(self._chats)
+
+    def watchlist(self, chat_id):
+        # Chat chưa /start vẫn dùng được /add, /list...: tự đăng ký khi cần
+        self.register(chat_id)
+        with self._lock:
+            watchlist = self._watchlists.get(chat_id)
+            if watchlist is None:
+                watchlist = self._watchlists[chat_id] = Watchlist(
+                    self._chats[chat_id]['checklist'], on_change=self._on_watchlist_changed
+                )
+            return watchlist
+
+    def threshold(self, chat_id):
+        with self._lock:
+            settings = self._chats.get(chat_id)
+            return settings['threshold'] if settings is not None else self.default_threshold
+
+    def set_threshold(self, chat_id, threshold):
+        self.register(chat_id)
+        with self._lock:
+            self._chats[chat_id]['threshold'] = threshold
+            self._persist()
+
+    def symbols_by_chat(self):
+        # Trong lượt này watchlist thay đổi chỉ được ghi nhận; on_change chạy một lần ở cuối lượt ngoài cùng
+        depth = getattr(self._local, 'depth', 0)
+        self._local.depth = depth + 1
+        try:
+            symbols_by_chat = {chat_id: self.watchlist(chat_id).symbols() for chat_id in self.chats()}
+        finally:
+            self._local.depth = depth
+
+        if depth == 0 and getattr(self._local, 'pending', False):
+            self._local.pending = False
+            if self.on_change is not None:
+                self.on_change(self._union(symbols_by_chat))
+        return symbols_by_chat
+
+    def all_symbols(self):
+        return self._union(self.symbols_by_chat())
+
+    @staticmethod
+    def _union(symbols_by_chat):
+        # Hợp các danh sách, giữ thứ tự xuất hiện, mỗi symbol một lần
+        symbols = {}
+        for chat_symbols in symbols_by_chat.values():
+            symbols.update(dict.fromkeys(chat_symbols))
+        return list(symbols)
+
+    def _on_watchlist_changed(self, _symbols):
+        # Không đọc lại watchlist nào ở đây: lượt symbols_by_chat() đang chạy (hoặc lượt mới) sẽ báo hợp cuối cùng
+        self._local.pending = True
+        if not getattr(self._local, 'depth', 0):
+            self.symbols_by_chat()
@@ -0,0 +1,70 @@
+import threading
+import time
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+class CircuitBreaker:
+    """
+    Connectivity state derived from real request outcomes. After
+    failure_threshold consecutive failures the circuit opens and requests
+    fail fast; once the cooldown passes a single half-open probe is let
+    through. A failed probe reopens the circuit with a doubled cooldown
+    (capped at max_delay), a successful one closes it.
+    """
+
+    def __init__(self, failure_threshold=3, base_delay=5.0, max_delay=300.0):
+        self.failure_threshold = failure_threshold
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.state = CLOSED
+        self._failures = 0
+        self._delay = base_delay
+        self._opened_until = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        # Trạng thái bình thường: không tốn thêm gì ngoài một lần lấy lock
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN:
+                if time.monotonic() < self._opened_until:
+                    return False
+                self.state = HALF_OPEN
+            # Nửa mở: chỉ cho một request thăm dò đi qua tại một thời điểm
+            if self._probing:
+                return False
+            self._probing = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            if self.state != CLOSED:
+                print("Kết nối Binance đã khôi phục.")
+            self.state = CLOSED
+            self._failures = 0
+            self._delay = self.base_delay
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self.state == HALF_OPEN:
+                # Thăm dò thất bại: mở lại và tăng gấp đôi thời gian chờ
+                self._delay = min(self._delay * 2, self.max_delay)
+            elif self._failures < self.failure_threshold:
+                return
+            self.state = OPEN
+            self._opened_until = time.monotonic() + self._delay
+            self._probing = False
+            print(f"Mất kết nối Binance, tạm dừng request trong {self._delay:g} giây.")
+
+    def retry_in(self):
+        # Số giây còn lại trước lần thăm dò tiếp theo (0 nếu có thể gửi request ngay)
+        with self._lock:
+            if self.state != OPEN:
+                return 0.0
+            return max(0.0, self._opened_until - time.monotonic())
@@ -0,0 +1,80 @@
+import threading
+from kline_store import INTERVAL_MS
+
+class SymbolState:
+    def __init__(self, day_start):
+        self.day_start = day_start
+        # Danh sách (open_time, low) của 2 nến có low thấp nhất và 2 nến có low cao nhất đã đóng
+        self.lowest = []
+        self.highest = []
+        self.last_open_time = None
+
+class IntradayTracker:
+    """
+    Running top-2/bottom-2 candle lows per symbol for the current UTC day.
+    Only candles newer than the last closed one need to be fetched; the
+    still-open candle is folded into the result but never into the state.
+    """
+
+    def __init__(self, interval='5m'):
+        self.interval = interval
+        self.step = INTERVAL_MS[interval]
+        self._states = {}
+        self._lock = threading.Lock()
+
+    def fetch_start(self, symbol, day_start):
+        # Thời điểm (ms) cần lấy nến từ đó: nến sau nến đã đóng cuối cùng, hoặc 00:00 UTC
+        with self._lock:
+            state = self._states.get(symbol)
+            if state is None or state.day_start != day_start or state.last_open_time is None:
+                return day_start
+            return state.last_open_time + self.step
+
+    def update(self, symbol, klines, day_start, now_ms):
+        """
+        Fold new klines into the symbol's state and return (lowest_2, highest_2)
+        as lists of (open_time, low), or None if nothing is known yet today.
+        """
+        with self._lock:
+            state = self._states.get(symbol)
+            if state is None or state.day_start != day_start:
+                state = SymbolState(day_start)
+                self._states[symbol] = state
+
+            open_candle = []
+            closed = []
+            for kline in klines:
+                open_time = int(kline[0])
+                if open_time < day_start:
+                    continue
+                if state.last_open_time is not None and open_time <= state.last_open_time:
+                    continue
+                if open_time + self.step <= now_ms:
+                    closed.append((open_time, float(kline[3])))
+                else:
+                    open_candle.append((open_time, float(kline[3])))
+
+            if closed:
+                state.lowest, state.highest = self._select(state.lowest + state.highest + closed)
+                state.last_open_time = closed[-1][0]
+
+            candidates = state.lowest + state.highest + open_candle
+            if not candidates:
+                return None
+            return self._select(candidates)
+
+    def discard(self, symbols):
+        with self._lock:
+            for symbol in symbols:
+                self._states.pop(symbol, None)
+
+    def reset(self):
+        with self._lock:
+            self._states.clear()
+
+    @staticmethod
+    def _select(candidates):
+        # Bỏ trùng theo open_time, sắp xếp theo thời gian rồi theo low (ổn định như cách sort cũ)
+        unique = sorted(dict(candidates).items())
+        unique.sort(key=lambda x: x[1])
+        return unique[:2], unique[-2:]
@@ -0,0 +1,235 @@
+import os
+import sqlite3
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import binance_client
+from candles import Candles
+
+# File SQLite lưu nến đã tải về, khóa chính (symbol, interval, open_time)
+KLINE_DB_FILE = os.getenv('KLINE_DB_FILE', 'klines.db')
+
+# Số nến tối đa Binance trả về trong một request /klines
+KLINES_PAGE_LIMIT = 1000
+
+# Số trang /klines tải song song cho một khoảng dài
+DOWNLOAD_CONCURRENCY = int(os.getenv('KLINE_DOWNLOAD_CONCURRENCY', 8))
+
+INTERVAL_MS = {
+    '1m': 60 * 1000,
+    '3m': 3 * 60 * 1000,
+    '5m': 5 * 60 * 1000,
+    '15m': 15 * 60 * 1000,
+    '30m': 30 * 60 * 1000,
+    '1h': 60 * 60 * 1000,
+    '2h': 2 * 60 * 60 * 1000,
+    '4h': 4 * 60 * 60 * 1000,
+    '1d': 24 * 60 * 60 * 1000,
+}
+
+class KlineStore:
+    """
+    On-disk cache of closed candles. get_candles() and iter_candles() answer
+    from SQLite and only download the ranges that were never fetched, plus
+    the candle that is still open (it is never marked as covered).
+    """
+
+    def __init__(self, path=KLINE_DB_FILE):
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._conn:
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS klines (
+                    symbol TEXT NOT NULL,
+                    interval TEXT NOT NULL,
+                    open_time INTEGER NOT NULL,
+                    open TEXT, high TEXT, low TEXT, close TEXT, volume TEXT,
+                    close_time INTEGER, quote_volume TEXT, trades INTEGER,
+                    taker_base_volume TEXT, taker_quote_volume TEXT,
+                    PRIMARY KEY (symbol, interval, open_time)
+                ) WITHOUT ROWID
+            """)
+            # Các khoảng open_time [start, end] đã tải đủ (kể cả khoảng không có giao dịch)
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS coverage (
+                    symbol TEXT NOT NULL,
+                    interval TEXT NOT NULL,
+                    start_time INTEGER NOT NULL,
+                    end_time INTEGER NOT NULL
+                )
+            """)
+            self._conn.execute("CREATE INDEX IF NOT EXISTS coverage_idx ON coverage (symbol, interval)")
+
+    def get_candles(self, symbol, interval, start_ms, end_ms):
+        bounds = self._sync(symbol, interval, start_ms, end_ms)
+        if bounds is None:
+            return Candles.empty()
+        return self._read_candles(symbol, interval, *bounds)
+
+    def read_candles(self, symbol, interval, start_ms, end_ms):
+        # Chỉ đọc nến đã có trong SQLite, không gọi API (replay/backtest offline)
+        step = INTERVAL_MS[interval]
+        first_open = (start_ms + step - 1) // step * step
+        last_open = end_ms // step * step
+        if last_open < first_open:
+            return Candles.empty()
+        return self._read_candles(symbol, interval, first_open, last_open)
+
+    def iter_candles(self, symbol, interval, start_ms, end_ms):
+        """
+        Yield Candles pages of at most KLINES_PAGE_LIMIT candles in chronological
+        order. Up to DOWNLOAD_CONCURRENCY pages are synced ahead in parallel, so
+        memory stays bounded however long the range is.
+        """
+        step = INTERVAL_MS[interval]
+        first_open = (start_ms + step - 1) // step * step
+        last_open = end_ms // step * step
+        page_span = KLINES_PAGE_LIMIT * step
+        pages = iter([(page_start, min(page_start + page_span - step, last_open)) for page_start in range(first_open, last_open + 1, page_span)])
+
+        with ThreadPoolExecutor(max_workers=DOWNLOAD_CONCURRENCY) as executor:
+            pending = deque()
+
+            def submit_next():
+                page = next(pages, None)
+                if page is not None:
+                    pending.append((page, executor.submit(self._sync, symbol, interval, page[0], page[1])))
+
+            for _ in range(DOWNLOAD_CONCURRENCY):
+                submit_next()
+
+            while pending:
+                page, future = pending.popleft()
+                future.result()
+                submit_next()
+                yield self._read_candles(symbol, interval, page[0], page[1])
+
+    def _read_candles(self, symbol, interval, first_open, last_open):
+        # SQLite đổi giá sang REAL, numpy nhận nguyên khối không cần parse từng chuỗi
+        with self._lock:
+            cursor = self._conn.execute(
+                "SELECT open_time, CAST(open AS REAL), CAST(high AS REAL), CAST(low AS REAL), "
+                "CAST(close AS REAL), CAST(volume AS REAL), close_time, CAST(quote_volume AS REAL), trades, "
+                "CAST(taker_base_volume AS REAL), CAST(taker_quote_volume AS REAL) FROM klines "
+                "WHERE symbol = ? AND interval = ? AND open_time BETWEEN ? AND ? ORDER BY open_time",
+                (symbol, interval, first_open, last_open)
+            )
+            rows = cursor.fetchall()
+        if not rows:
+            return Candles.empty()
+
+        return Candles.from_table(np.array(rows, dtype=np.float64))
+
+    def _sync(self, symbol, interval, start_ms, end_ms):
+        # Tải các khoảng còn thiếu, trả về (first_open, last_open) cần đọc hoặc None nếu khoảng rỗng
+        step = INTERVAL_MS[interval]
+        first_open = (start_ms + step - 1) // step * step
+        last_open = end_ms // step * step
+        if last_open < first_open:
+            return None
+
+        # Nến đang chạy chưa đóng -> luôn tải lại, không đánh dấu đã có
+        open_candle = int(time.time() * 1000) // step * step
+
+        for gap_start, gap_end in self._missing_ranges(symbol, interval, first_open, last_open, step):
+            rows = self._download(symbol, interval, gap_start, gap_end, step)
+            covered_end = min(gap_end, open_candle - step)
+            with self._lock, self._conn:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO klines VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    [(symbol, interval, int(k[0]), k[1], k[2], k[3], k[4], k[5], int(k[6]), k[7], int(k[8]), k[9], k[10]) for k in rows]
+                )
+                if covered_end >= gap_start:
+                    self._add_coverage(symbol, interval, gap_start, covered_end, step)
+
+        return first_open, last_open
+
+    def _coverage(self, symbol, interval):
+        cursor = self._conn.execute(
+            "SELECT start_time, end_time FROM coverage WHERE symbol = ? AND interval = ? ORDER BY start_time",
+            (symbol, interval)
+        )
+        return cursor.fetchall()
+
+    def _add_coverage(self, symbol, interval, start, end, step):
+        # Gộp khoảng mới với các khoảng chồng lấn/liền kề để bảng coverage luôn gọn
+        for old_start, old_end in self._coverage(symbol, interval):
+            if old_start <= end + step and old_end + step >= start:
+                start = min(start, old_start)
+                end = max(end, old_end)
+        self._conn.execute(
+            "DELETE FROM coverage WHERE symbol = ? AND interval = ? AND start_time <= ? AND end_time >= ?",
+            (symbol, interval, end, start)
+        )
+        self._conn.execute("INSERT INTO coverage VALUES (?, ?, ?, ?)", (symbol, interval, start, end))
+
+    def _missing_ranges(self, symbol, interval, first_open, last_open, step):
+        with self._lock:
+            coverage = self._coverage(symbol, interval)
+
+        gaps = []
+        cursor = first_open
+        for start, end in coverage:
+            if end < cursor:
+                continue
+            if start > last_open:
+                break
+            if start > cursor:
+                gaps.append((cursor, start - step))
+            cursor = max(cursor, end + step)
+        if cursor <= last_open:
+            gaps.append((cursor, last_open))
+        return gaps
+
+    def _download(self, symbol, interval, start, end, step):
+        # Chia khoảng thành các trang đúng KLINES_PAGE_LIMIT nến theo interval, tải song song
+        page_span = KLINES_PAGE_LIMIT * step
+        pages = [(page_start, min(page_start + page_span - step, end)) for page_start in range(start, end + 1, page_span)]
+
+        def fetch_page(page):
+            page_start, page_end = page
+            params = {
+                'symbol': symbol,
+                'interval': interval,
+                'startTime': page_start,
+                'endTime': page_end + step - 1,
+                'limit': KLINES_PAGE_LIMIT
+            }
+            response = binance_client.get('/klines', params=params)
+            klines = response.json()
+            if response.status_code != 200 or not isinstance(klines, list):
+                message = klines.get('msg') if isinstance(klines, dict) else response.text
+                raise ValueError(f"Binance klines error for {symbol}: {message}")
+            return klines
+
+        if len(pages) == 1:
+            return fetch_page(pages[0])
+
+        # Rate limiter trong binance_client giới hạn tổng weight, map() giữ đúng thứ tự các trang
+        rows = []
+        with ThreadPoolExecutor(max_workers=min(DOWNLOAD_CONCURRENCY, len(pages))) as executor:
+            for klines in executor.map(fetch_page, pages):
+                rows.extend(klines)
+        return rows
+
+_store = None
+_store_lock = threading.Lock()
+
+def get_store():
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = KlineStore()
+    return _store
+
+def get_candles(symbol, interval, start_ms, end_ms):
+    return get_store().get_candles(symbol, interval, start_ms, end_ms)
+
+def read_candles(symbol, interval, start_ms, end_ms):
+    return get_store().read_candles(symbol, interval, start_ms, end_ms)
+
+def iter_candles(symbol, interval, start_ms, end_ms):
+    return get_store().iter_candles(symbol, interval, start_ms, end_ms)
@@ -0,0 +1,118 @@
+import asyncio
+import json
+import os
+import threading
+from websockets.asyncio.client import connect
+
+# URL combined stream của Binance, có thể trỏ sang server WebSocket giả lập khi test
+STREAM_URL = os.getenv('BINANCE_STREAM_URL', 'wss://stream.binance.com:9443/stream')
+RECONNECT_BACKOFF_MAX = 60
+
+class KlineStream:
+    """
+    Subscribe to combined <symbol>@kline_<interval> streams on a background
+    thread. on_kline_closed(symbol, kline) is called from a worker thread with
+    a REST-shaped kline row every time a candle closes. update_symbols()
+    sends SUBSCRIBE/UNSUBSCRIBE on the live connection.
+    """
+
+    def __init__(self, symbols, on_kline_closed, interval='5m', url=STREAM_URL):
+        self.interval = interval
+        self.url = url
+        self.on_kline_closed = on_kline_closed
+        self._symbols = {symbol.upper() for symbol in symbols}
+        self._subscribed = set()
+        self._lock = threading.Lock()
+        self._loop = None
+        self._ws = None
+        self._thread = None
+        self._stopped = False
+        self._request_id = 0
+
+    def start(self):
+        self._thread = threading.Thread(target=lambda: asyncio.run(self._run()))
+        self._thread.start()
+
+    def stop(self):
+        self._stopped = True
+        if self._loop is not None and self._ws is not None:
+            asyncio.run_coroutine_threadsafe(self._ws.close(), self._loop)
+
+    def update_symbols(self, symbols):
+        with self._lock:
+            self._symbols = {symbol.upper() for symbol in symbols}
+        if self._loop is not None:
+            asyncio.run_coroutine_threadsafe(self._sync_subscriptions(), self._loop)
+
+    def _stream_name(self, symbol):
+        return f"{symbol.lower()}@kline_{self.interval}"
+
+    async def _run(self):
+        self._loop = asyncio.get_running_loop()
+        backoff = 1
+        while not self._stopped:
+            with self._lock:
+                symbols = set(self._symbols)
+            if not symbols:
+                # Danh sách trống: chờ đến khi có coin mới kết nối
+                await asyncio.sleep(1)
+                continue
+
+            try:
+                streams = '/'.join(self._stream_name(symbol) for symbol in sorted(symbols))
+                async with connect(f"{self.url}?streams={streams}") as ws:
+                    self._ws = ws
+                    self._subscribed = symbols
+                    backoff = 1
+                    print(f"Đã kết nối kline stream cho {len(symbols)} coin.")
+
+                    # Danh sách có thể đã thay đổi trong lúc đang kết nối
+                    await self._sync_subscriptions()
+                    async for raw in ws:
+                        self._handle_message(raw)
+            except Exception as e:
+                print(f"Lỗi kline stream: {e}. Kết nối lại sau {backoff} giây...")
+            finally:
+                self._ws = None
+                self._subscribed = set()
+
+            if not self._stopped:
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, RECONNECT_BACKOFF_MAX)
+
+    async def _sync_subscriptions(self):
+        if self._ws is None:
+            return
+        with self._lock:
+            symbols = set(self._symbols)
+        added = symbols - self._subscribed
+        removed = self._subscribed - symbols
+
+        for method, changed in (('SUBSCRIBE', added), ('UNSUBSCRIBE', removed)):
+            if not changed:
+                continue
+            self._request_id += 1
+            await self._ws.send(json.dumps({
+                'method': method,
+                'params': [self._stream_name(symbol) for symbol in sorted(changed)],
+                'id': self._request_id
+            }))
+        self._subscribed = symbols
+
+    def _handle_message(self, raw):
+        try:
+            message = json.loads(raw)
+        except ValueError:
+            return
+
+        # Bỏ qua phản hồi của SUBSCRIBE/UNSUBSCRIBE ({"result": null, "id": ...})
+        data = message.get('data') if isinstance(message, dict) else None
+        if not data or data.get('e') != 'kline':
+            return
+
+        k = data['k']
+        if not k.get('x'):
+            return  # Nến chưa đóng
+
+        kline = [k['t'], k['o'], k['h'], k['l'], k['c'], k['v'], k['T'], k['q'], k['n'], k['V'], k['Q'], '0']
+        self._loop.run_in_executor(None, self.on_kline_closed, k['s'], kline)
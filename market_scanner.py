@@ -0,0 +1,120 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+import binance_client
+from candles import DAY_MS, Candles
+
+# Chỉ quét các cặp có đồng định giá này (ví dụ ...USDT)
+SCAN_QUOTE_ASSET = os.getenv('SCAN_QUOTE_ASSET', 'USDT')
+
+# Số symbol trả về mặc định và tối đa cho /scan
+SCAN_TOP_K = int(os.getenv('SCAN_TOP_K', 10))
+SCAN_MAX_TOP_K = 50
+
+# Bỏ các cặp thanh khoản thấp (quoteVolume 24h, tính theo đồng định giá)
+SCAN_MIN_QUOTE_VOLUME = float(os.getenv('SCAN_MIN_QUOTE_VOLUME', 0))
+
+# Lấy klines cho tối đa SCAN_FETCH_FACTOR * top_k cặp, tránh tốn weight khi cận trên quá lỏng
+SCAN_FETCH_FACTOR = int(os.getenv('SCAN_FETCH_FACTOR', 1))
+
+SCAN_CONCURRENCY = int(os.getenv('SCAN_CONCURRENCY', 10))
+
+def fetch_market_tickers():
+    # Toàn bộ thị trường trong một request /ticker/24hr (weight 80)
+    response = binance_client.get('/ticker/24hr')
+    response.raise_for_status()
+    return response.json()
+
+def select_candidates(tickers, quote=SCAN_QUOTE_ASSET, min_quote_volume=SCAN_MIN_QUOTE_VOLUME):
+    """
+    Keep the active quote pairs and order them by their rolling 24h
+    highPrice / lowPrice, highest first. The 24h window always covers the
+    UTC day so far, so this is an upper bound on the intraday ratio of
+    lows the scanner computes: a pair below the bound can be skipped.
+    """
+    candidates = []
+    for ticker in tickers:
+        symbol = ticker.get('symbol', '')
+        if not symbol.endswith(quote):
+            continue
+        try:
+            high = float(ticker['highPrice'])
+            low = float(ticker['lowPrice'])
+            quote_volume = float(ticker.get('quoteVolume', 0))
+        except (KeyError, TypeError, ValueError):
+            continue
+        # Cặp đã ngừng giao dịch vẫn có trong /ticker/24hr với count = 0
+        if low <= 0 or int(ticker.get('count', 1)) == 0 or quote_volume < min_quote_volume:
+            continue
+        candidates.append({
+            'symbol': symbol,
+            'bound': high / low,
+            'change': float(ticker.get('priceChangePercent', 0)),
+            'quote_volume': quote_volume
+        })
+    candidates.sort(key=lambda candidate: candidate['bound'], reverse=True)
+    return candidates
+
+def fetch_intraday_ratio(symbol, day_start, now_ms, interval='5m'):
+    # Tỉ lệ low cao nhất / low thấp nhất của các nến 5m từ 00:00 UTC, như check_coin_limits
+    response = binance_client.get('/klines', params={
+        'symbol': symbol,
+        'interval': interval,
+        'startTime': day_start,
+        'endTime': now_ms,
+        'limit': 500
+    })
+    response.raise_for_status()
+    lows = Candles.from_klines(response.json()).low
+    if not len(lows) or lows.min() <= 0:
+        return None
+    return float(lows.max() / lows.min())
+
+def scan_market(top_k=SCAN_TOP_K, quote=SCAN_QUOTE_ASSET, min_quote_volume=SCAN_MIN_QUOTE_VOLUME,
+                fetch_factor=SCAN_FETCH_FACTOR, concurrency=SCAN_CONCURRENCY):
+    """
+    Rank the whole market by the intraday high/low ratio of 5m lows with one
+    /ticker/24hr request plus klines for as few pairs as possible: candidates
+    are fetched in bound order, top_k at a time, until the k-th best ratio
+    found is at least the next candidate's bound, or fetch_factor * top_k
+    pairs were fetched.
+    Returns {'results', 'pairs', 'fetched', 'requests', 'exact'}.
+    """
+    now_ms = int(time.time() * 1000)
+    day_start = now_ms // DAY_MS * DAY_MS
+    candidates = select_candidates(fetch_market_tickers(), quote, min_quote_volume)
+    requests_made = 1
+    max_fetch = max(1, fetch_factor) * top_k
+
+    results = []
+    fetched = 0
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+        while fetched < min(len(candidates), max_fetch):
+            if len(results) >= top_k and results[top_k - 1]['ratio'] >= candidates[fetched]['bound']:
+                break
+
+            batch = candidates[fetched:min(fetched + max(top_k, 1), max_fetch)]
+            ratios = executor.map(lambda candidate: _safe_ratio(candidate['symbol'], day_start, now_ms), batch)
+            for candidate, ratio in zip(batch, ratios):
+                if ratio is not None:
+                    results.append(dict(candidate, ratio=ratio))
+            fetched += len(batch)
+            requests_made += len(batch)
+            results.sort(key=lambda result: result['ratio'], reverse=True)
+
+    # exact = True khi không còn cặp nào chưa lấy có thể lọt vào top_k
+    exact = fetched >= len(candidates) or (len(results) >= top_k and results[top_k - 1]['ratio'] >= candidates[fetched]['bound'])
+    return {
+        'results': results[:top_k],
+        'pairs': len(candidates),
+        'fetched': fetched,
+        'requests': requests_made,
+        'exact': exact
+    }
+
+def _safe_ratio(symbol, day_start, now_ms):
+    try:
+        return fetch_intraday_ratio(symbol, day_start, now_ms)
+    except Exception as e:
+        print(f"Lỗi khi lấy dữ liệu {symbol}: {e}")
+        return None
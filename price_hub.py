@@ -0,0 +1,78 @@
+import queue
+import threading
+import time
+import binance_client
+
+class PriceHub:
+    """
+    One upstream ticker poller per symbol, fanned out to every subscriber.
+    A poller starts with the first subscriber of a symbol and stops when the
+    last one leaves, so upstream load grows with symbols, not with viewers.
+    """
+
+    def __init__(self, interval=1.0, fetch=None):
+        self.interval = interval
+        # Hàm lấy giá tùy chọn (ví dụ qua cache), mặc định gọi thẳng /ticker/price
+        self.fetch = fetch
+        self._subscribers = {}
+        self._lock = threading.Lock()
+
+    def subscribe(self, symbol):
+        # Mỗi subscriber chỉ giữ giá mới nhất, client chậm không làm đầy bộ nhớ
+        subscriber = queue.Queue(maxsize=1)
+        with self._lock:
+            subscribers = self._subscribers.get(symbol)
+            if subscribers is None:
+                subscribers = self._subscribers[symbol] = set()
+                threading.Thread(target=self._poll, args=(symbol, subscribers), daemon=True).start()
+            subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, symbol, subscriber):
+        with self._lock:
+            subscribers = self._subscribers.get(symbol)
+            if subscribers is None:
+                return
+            subscribers.discard(subscriber)
+            if not subscribers:
+                del self._subscribers[symbol]
+
+    def _poll(self, symbol, subscribers):
+        while True:
+            started = time.monotonic()
+            # Dừng khi hết subscriber (hoặc đã có poller mới thay thế cho symbol này)
+            with self._lock:
+                if self._subscribers.get(symbol) is not subscribers:
+                    return
+
+            self._publish(symbol, self._fetch(symbol))
+            time.sleep(max(0.0, self.interval - (time.monotonic() - started)))
+
+    def _fetch(self, symbol):
+        try:
+            if self.fetch is not None:
+                return self.fetch(symbol)
+            response = binance_client.get('/ticker/price', params={'symbol': symbol})
+            data = response.json()
+            if 'price' not in data:
+                return {'error': 'No data available'}
+            return {
+                'timestamp': int(time.time() * 1000),
+                'close': float(data['price'])
+            }
+        except Exception as e:
+            return {'error': str(e)}
+
+    def _publish(self, symbol, message):
+        with self._lock:
+            subscribers = list(self._subscribers.get(symbol, ()))
+        for subscriber in subscribers:
+            # Bỏ giá cũ chưa được đọc, chỉ giữ giá mới nhất
+            try:
+                subscriber.get_nowait()
+            except queue.Empty:
+                pass
+            try:
+                subscriber.put_nowait(message)
+            except queue.Full:
+                pass
@@ -0,0 +1,89 @@
+import threading
+import time
+
+# Weight của từng endpoint theo tài liệu Binance Spot API
+ENDPOINT_WEIGHTS = {
+    '/klines': 2,
+    '/ticker/price': 2,
+    '/ticker/24hr': 2,
+    '/order': 1,
+    '/allOrders': 20,
+}
+DEFAULT_WEIGHT = 1
+
+def endpoint_weight(path, params=None):
+    params = params or {}
+
+    # Các endpoint ticker không truyền symbol sẽ trả về toàn bộ thị trường, weight cao hơn
+    if path == '/ticker/price' and 'symbol' not in params:
+        return 4
+    if path == '/ticker/24hr' and 'symbol' not in params:
+        return 80
+
+    return ENDPOINT_WEIGHTS.get(path, DEFAULT_WEIGHT)
+
+class WeightRateLimiter:
+    """
+    Token bucket measured in Binance request weight, shared by all threads.
+    The bucket refills at limit_per_minute / 60 per second and is resynced
+    from the X-MBX-USED-WEIGHT-1M header of every response.
+    """
+
+    def __init__(self, limit_per_minute, safety_margin=0.9):
+        self.capacity = limit_per_minute * safety_margin
+        self.refill_rate = self.capacity / 60.0
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self.blocked_until = 0.0
+        self.used_weight = 0.0  # X-MBX-USED-WEIGHT-1M gần nhất
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        elapsed = now - self.updated_at
+        self.tokens = min(self.capacity, self.tokens + elapsed * self.refill_rate)
+        self.updated_at = now
+
+    def acquire(self, weight):
+        # Request có weight lớn hơn capacity vẫn được chạy khi bucket đầy
+        weight = min(weight, self.capacity)
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if now < self.blocked_until:
+                    wait_time = self.blocked_until - now
+                elif self.tokens >= weight:
+                    self.tokens -= weight
+                    return
+                else:
+                    wait_time = (weight - self.tokens) / self.refill_rate
+            time.sleep(wait_time)
+
+    def update_from_headers(self, headers):
+        used = None
+        for key, value in headers.items():
+            if key.lower() == 'x-mbx-used-weight-1m':
+                try:
+                    used = float(value)
+                except ValueError:
+                    return
+                break
+        if used is None:
+            return
+
+        with self._lock:
+            self.used_weight = used
+            self._refill(time.monotonic())
+            # Server là nguồn chính xác nhất: không bao giờ tin bucket nhiều hơn phần weight còn lại
+            self.tokens = min(self.tokens, max(0.0, self.capacity - used))
+
+    def available(self):
+        with self._lock:
+            self._refill(time.monotonic())
+            return self.tokens
+
+    def block(self, seconds):
+        # Gọi khi nhận 429/418: dừng toàn bộ request đến hết Retry-After
+        with self._lock:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+            self.tokens = 0.0
@@ -0,0 +1,105 @@
+import atexit
+import copy
+import json
+import os
+import threading
+from atomic_file import atomic_write
+
+class RatioStore:
+    """
+    In-memory previous_ratios of every chat, shared by the scheduler and
+    Telegram threads. Reads and writes never touch disk; a background thread
+    flushes changes every flush_interval seconds with an atomic temp-file
+    rename, and a final snapshot is written on shutdown.
+    """
+
+    # Khóa chứa dữ liệu của file định dạng cũ {symbol: {...}} (bản một chat)
+    LEGACY_KEY = 'legacy'
+
+    def __init__(self, path, flush_interval=5.0):
+        self.path = path
+        self.flush_interval = flush_interval
+        self._ratios = self._load()
+        self._dirty = False
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._flush_loop, daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def _load(self):
+        if os.path.exists(self.path):
+            with open(self.path, 'r') as f:
+                try:
+                    data = json.load(f)
+                except json.JSONDecodeError:
+                    return {}
+            if any(isinstance(value, dict) and 'ratio' in value for value in data.values()):
+                return {self.LEGACY_KEY: data}
+            return data
+        return {}
+
+    def snapshot(self, chat_id):
+        with self._lock:
+            return copy.deepcopy(self._ratios.get(str(chat_id), {}))
+
+    def get(self, chat_id, symbol):
+        with self._lock:
+            data = self._ratios.get(str(chat_id), {}).get(symbol)
+            return dict(data) if data is not None else None
+
+    def update(self, chat_id, ratios):
+        # Ghi đè các symbol trong ratios, giữ nguyên các symbol khác của chat
+        if not ratios:
+            return
+        with self._lock:
+            self._ratios.setdefault(str(chat_id), {}).update(copy.deepcopy(ratios))
+            self._dirty = True
+
+    def replace(self, chat_id, ratios):
+        with self._lock:
+            self._ratios[str(chat_id)] = copy.deepcopy(ratios)
+            self._dirty = True
+
+    def remove(self, chat_id, symbols):
+        with self._lock:
+            ratios = self._ratios.get(str(chat_id), {})
+            for symbol in symbols:
+                if ratios.pop(symbol, None) is not None:
+                    self._dirty = True
+
+    def adopt_legacy(self, chat_id):
+        # Chuyển previous_ratios của bản một chat sang chat đầu tiên đăng ký
+        with self._lock:
+            legacy = self._ratios.pop(self.LEGACY_KEY, None)
+            if legacy is not None:
+                self._ratios.setdefault(str(chat_id), legacy)
+                self._dirty = True
+
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                if not self._dirty:
+                    return
+                data = json.dumps(self._ratios)
+                self._dirty = False
+
+            # Ghi lỗi: đánh dấu lại để lần flush sau thử ghi tiếp
+            try:
+                atomic_write(self.path, data, prefix='.ratios-')
+            except Exception:
+                with self._lock:
+                    self._dirty = True
+                raise
+
+    def _flush_loop(self):
+        while not self._stopped.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Lỗi khi lưu {self.path}: {e}")
+
+    def close(self):
+        self._stopped.set()
+        self.flush()
@@ -0,0 +1,196 @@
+"""
+Offline replay of the scanner's ratio alert over stored candles.
+
+For every UTC day the live bot resets each symbol's previous ratio to 1.0,
+then on every scan tick computes ratio = highest low / lowest low of the
+day's candles and alerts when ratio >= previous + threshold, moving the
+previous ratio up to the alerted value. A chat gets one message per tick in
+which at least one of its symbols alerted.
+
+Here the same rule runs on a (symbol, day, candle) array of lows: the daily
+running max/min are cumulative numpy reductions, and only the threshold
+ratchet walks the ticks of a day, vectorized over every symbol-day at once.
+Candles come from the SQLite kline store (missing ranges are downloaded
+once, or skipped with --offline).
+
+    python replay.py --days 30 --threshold 0.005 0.01 0.02
+    python replay.py BTCUSDT ETHUSDT --tick 15m --alerts --json replay.json
+"""
+import argparse
+import json
+import time
+from datetime import datetime
+from pytz import timezone
+import numpy as np
+import kline_store
+from candles import DAY_MS
+from kline_store import INTERVAL_MS
+
+CHECKLIST_FILE = 'checklist.txt'
+DEFAULT_THRESHOLD = 0.01
+
+def load_lows(symbols, interval, start_day_ms, days, offline=False):
+    """
+    Return a float64 array lows[symbol, day, slot] of candle lows, NaN where
+    no candle is stored (gaps, symbol not listed yet).
+    """
+    step = INTERVAL_MS[interval]
+    slots = DAY_MS // step
+    lows = np.full((len(symbols), days, slots), np.nan)
+    end_ms = start_day_ms + days * DAY_MS - 1
+    read = kline_store.read_candles if offline else kline_store.get_candles
+
+    for index, symbol in enumerate(symbols):
+        try:
+            candles = read(symbol, interval, start_day_ms, end_ms)
+        except Exception as e:
+            print(f"Không lấy được nến của {symbol}: {e}")
+            continue
+        offsets = (candles.open_time - start_day_ms) // step
+        lows[index].reshape(-1)[offsets] = candles.low
+    return lows
+
+def tick_ratios(lows, interval, tick):
+    """
+    Ratio seen by each scan tick: ratios[symbol, day, k] for the tick at
+    day_start + (k + 1) * tick, over the day's candles closed by then. The
+    00:00 tick is the daily reset, so a day has DAY_MS // tick - 1 ticks.
+    """
+    per_tick = INTERVAL_MS[tick] // INTERVAL_MS[interval]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        # fmax/fmin bỏ qua NaN: khoảng trống giữ nguyên cực trị trước đó
+        ratios = np.fmax.accumulate(lows, axis=2) / np.fmin.accumulate(lows, axis=2)
+    return ratios[:, :, per_tick - 1::per_tick][:, :, :-1]
+
+def replay(ratios, threshold):
+    """
+    Run the alert ratchet over ratios[symbol, day, tick]. Returns (alerts,
+    previous): a boolean array of the symbol-ticks that alerted and the
+    previous ratio each tick compared against.
+    """
+    alerts = np.zeros(ratios.shape, dtype=bool)
+    previous = np.empty(ratios.shape)
+    current = np.ones(ratios.shape[:2])  # mốc 00:00: mọi symbol về 1.0
+    for k in range(ratios.shape[2]):
+        ratio = ratios[:, :, k]
+        previous[:, :, k] = current
+        with np.errstate(invalid='ignore'):
+            hit = ratio >= current + threshold  # NaN (chưa có nến) không bao giờ cảnh báo
+        alerts[:, :, k] = hit
+        current = np.where(hit, ratio, current)
+    return alerts, previous
+
+def tick_times(start_day_ms, days, tick):
+    # ms của từng tick, cùng hình dạng [day, tick] với kết quả replay
+    tick_ms = INTERVAL_MS[tick]
+    day_starts = start_day_ms + np.arange(days, dtype=np.int64)[:, None] * DAY_MS
+    return day_starts + np.arange(1, DAY_MS // tick_ms, dtype=np.int64)[None, :] * tick_ms
+
+def format_time(ms):
+    return datetime.fromtimestamp(ms / 1000, tz=timezone('UTC')).strftime('%d.%m.%y - %H:%M')
+
+def alert_stream(symbols, ratios, alerts, previous, times):
+    # Danh sách cảnh báo theo thời gian, mỗi phần tử là một symbol cảnh báo trong một tick
+    symbol_index, day, k = np.nonzero(alerts)
+    order = np.lexsort((symbol_index, times[day, k]))
+    stream = []
+    for s, d, t in zip(symbol_index[order], day[order], k[order]):
+        ratio = float(ratios[s, d, t])
+        prev = float(previous[s, d, t])
+        stream.append({
+            'time': format_time(int(times[d, t])),
+            'symbol': symbols[s],
+            'ratio': ratio,
+            'previous': prev,
+            'change': (ratio - prev) / prev * 100
+        })
+    return stream
+
+def summarize(symbols, ratios, alerts, threshold, top=10):
+    days = alerts.shape[1]
+    per_symbol = alerts.sum(axis=(1, 2))
+    messages_per_day = alerts.any(axis=0).sum(axis=1)  # mỗi tick có cảnh báo = một tin nhắn cho chat
+    alerted_ratios = ratios[alerts]
+    final_ratios = ratios[:, :, -1][~np.isnan(ratios[:, :, -1])]
+    return {
+        'threshold': threshold,
+        'symbols': len(symbols),
+        'days': days,
+        'ticks': alerts.shape[1] * alerts.shape[2],
+        'alerts': int(alerts.sum()),
+        'messages': int(messages_per_day.sum()),
+        'messages_per_day': float(messages_per_day.mean()) if days else 0.0,
+        'max_messages_per_day': int(messages_per_day.max()) if days else 0,
+        'alerts_per_symbol_day': float(per_symbol.sum() / (len(symbols) * days)) if len(symbols) and days else 0.0,
+        'median_alert_ratio': float(np.median(alerted_ratios)) if alerted_ratios.size else None,
+        'median_day_ratio': float(np.median(final_ratios)) if final_ratios.size else None,
+        'top_symbols': [(symbols[i], int(per_symbol[i])) for i in np.argsort(-per_symbol, kind='stable')[:top] if per_symbol[i]]
+    }
+
+def print_summary(summary):
+    print(f"Ngưỡng {summary['threshold']}: {summary['alerts']} cảnh báo, {summary['messages']} tin nhắn "
+          f"({summary['messages_per_day']:.1f}/ngày, tối đa {summary['max_messages_per_day']}), "
+          f"{summary['alerts_per_symbol_day']:.2f} cảnh báo/symbol/ngày")
+    if summary['median_alert_ratio'] is not None:
+        print(f"  Tỉ lệ trung vị lúc cảnh báo: {summary['median_alert_ratio']:.4f}, "
+              f"tỉ lệ cuối ngày trung vị: {summary['median_day_ratio']:.4f}")
+    if summary['top_symbols']:
+        print("  Nhiều cảnh báo nhất: " + ', '.join(f"{symbol} ({count})" for symbol, count in summary['top_symbols']))
+
+def read_symbols(path):
+    with open(path, 'r') as f:
+        return list(dict.fromkeys(line.strip().upper() for line in f if line.strip()))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('symbols', nargs='*', help=f'mặc định: các symbol trong {CHECKLIST_FILE}')
+    parser.add_argument('--checklist', default=CHECKLIST_FILE)
+    parser.add_argument('--days', type=int, default=30)
+    parser.add_argument('--end', help='ngày UTC cuối cùng (YYYY-MM-DD, mặc định: hôm qua)')
+    parser.add_argument('--threshold', type=float, nargs='+', default=[DEFAULT_THRESHOLD])
+    parser.add_argument('--interval', default='5m', choices=sorted(INTERVAL_MS, key=INTERVAL_MS.get), help='khung nến')
+    parser.add_argument('--tick', default='5m', choices=sorted(INTERVAL_MS, key=INTERVAL_MS.get), help='chu kỳ quét')
+    parser.add_argument('--offline', action='store_true', help='chỉ dùng nến đã lưu, không gọi API')
+    parser.add_argument('--alerts', action='store_true', help='in toàn bộ chuỗi cảnh báo')
+    parser.add_argument('--json', help='ghi kết quả ra file JSON')
+    args = parser.parse_args()
+
+    if INTERVAL_MS[args.tick] % INTERVAL_MS[args.interval] or INTERVAL_MS[args.tick] >= DAY_MS:
+        parser.error('--tick phải là bội của --interval và nhỏ hơn 1 ngày')
+    symbols = [symbol.upper() for symbol in args.symbols] or read_symbols(args.checklist)
+
+    if args.end:
+        end_day = datetime.strptime(args.end, '%Y-%m-%d').replace(tzinfo=timezone('UTC'))
+        end_day_ms = int(end_day.timestamp() * 1000)
+    else:
+        end_day_ms = int(time.time() * 1000) // DAY_MS * DAY_MS - DAY_MS
+    start_day_ms = end_day_ms - (args.days - 1) * DAY_MS
+
+    started = time.perf_counter()
+    lows = load_lows(symbols, args.interval, start_day_ms, args.days, offline=args.offline)
+    loaded = time.perf_counter()
+    ratios = tick_ratios(lows, args.interval, args.tick)
+    times = tick_times(start_day_ms, args.days, args.tick)
+
+    results = []
+    for threshold in args.threshold:
+        alerts, previous = replay(ratios, threshold)
+        summary = summarize(symbols, ratios, alerts, threshold)
+        stream = alert_stream(symbols, ratios, alerts, previous, times)
+        results.append({'summary': summary, 'alerts': stream})
+    finished = time.perf_counter()
+
+    print(f"{len(symbols)} symbol x {args.days} ngày ({format_time(start_day_ms)} -> {format_time(end_day_ms + DAY_MS)}), "
+          f"nến {args.interval}, quét mỗi {args.tick}: tải nến {loaded - started:.2f}s, replay {finished - loaded:.2f}s")
+    for result in results:
+        print_summary(result['summary'])
+        if args.alerts:
+            for alert in result['alerts']:
+                print(f"  {alert['time']}  {alert['symbol']:<14} {alert['ratio']:.4f} (+{alert['change']:.2f}%)")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,131 @@
+import math
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+DAY_SECONDS = 24 * 60 * 60
+
+class AlignedScheduler:
+    """
+    Runs job(slot_time) on wall-clock aligned slots (every interval seconds,
+    offset seconds past each boundary). Deadlines advance on the monotonic
+    clock, so a slow tick or a wall-clock jump does not shift the cadence.
+    A tick that overruns its slot never piles up: the missed slots are
+    skipped, or with overrun='coalesce' replaced by a single catch-up run.
+    day_job(slot_time) runs exactly once per UTC day, in place of the first
+    tick of the new day. slot_time is the slot's epoch time in seconds.
+    """
+
+    def __init__(self, interval, job, offset=0.0, day_job=None, overrun='skip', history=100):
+        if overrun not in ('skip', 'coalesce'):
+            raise ValueError(f"overrun phải là 'skip' hoặc 'coalesce', không phải {overrun!r}")
+        self.interval = interval
+        self.job = job
+        self.offset = offset
+        self.day_job = day_job
+        self.overrun = overrun
+        self.ticks = deque(maxlen=history)  # các lượt chạy gần nhất
+        self.overruns = 0
+        self.skipped = 0
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+
+    def stats(self):
+        with self._lock:
+            ticks = list(self.ticks)
+            return {
+                'ticks': len(ticks),
+                'overruns': self.overruns,
+                'skipped': self.skipped,
+                'last': ticks[-1] if ticks else None,
+                'avg_duration': sum(tick['duration'] for tick in ticks) / len(ticks) if ticks else 0.0,
+                'max_lag': max((tick['lag'] for tick in ticks), default=0.0)
+            }
+
+    def _first_slot(self):
+        # Mốc đầu tiên theo giờ thực, sau đó chỉ cộng interval trên đồng hồ monotonic
+        now_wall = time.time()
+        now_mono = time.monotonic()
+        slot_time = (math.floor((now_wall - self.offset) / self.interval) + 1) * self.interval + self.offset
+        return now_mono + (slot_time - now_wall), slot_time
+
+    def _run(self):
+        deadline, slot_time = self._first_slot()
+        current_day = int(time.time() // DAY_SECONDS)
+
+        while True:
+            wait_time = max(0.0, deadline - time.monotonic())
+            print(f"Đợi {wait_time:.2f} giây đến lần chạy tiếp theo lúc {datetime.fromtimestamp(slot_time).strftime('%H:%M:%S')}.")
+            if self._stopped.wait(wait_time):
+                return
+
+            started = time.monotonic()
+            day = int(slot_time // DAY_SECONDS)
+            kind = 'tick'
+            try:
+                if day != current_day and self.day_job is not None:
+                    kind = 'day'
+                    self.day_job(slot_time)
+                else:
+                    self.job(slot_time)
+            except Exception as e:
+                print(f"Lỗi khi chạy lượt {datetime.fromtimestamp(slot_time).strftime('%H:%M:%S')}: {e}")
+            finally:
+                current_day = day
+            finished = time.monotonic()
+
+            tick = {
+                'slot_time': slot_time,
+                'kind': kind,
+                'lag': started - deadline,  # trễ so với mốc (do lượt trước chạy lâu hoặc luồng bị chặn)
+                'duration': finished - started,
+                'missed': 0
+            }
+
+            deadline += self.interval
+            slot_time += self.interval
+            if finished > deadline:
+                # Lượt này chạy quá mốc tiếp theo: bỏ các mốc đã lỡ thay vì chạy dồn
+                missed = int((finished - deadline) // self.interval) + 1
+                skip = missed - 1 if self.overrun == 'coalesce' else missed
+                deadline += skip * self.interval
+                slot_time += skip * self.interval
+                tick['missed'] = missed
+                print(f"Lượt chạy mất {tick['duration']:.2f} giây, vượt {missed} mốc; "
+                      f"{'chạy bù một lần' if self.overrun == 'coalesce' else 'bỏ qua các mốc đã lỡ'}.")
+
+            with self._lock:
+                self.ticks.append(tick)
+                if tick['missed']:
+                    self.overruns += 1
+                    self.skipped += skip
+
+def staggered(items, batch_size, window):
+    """
+    Yield items in batches of batch_size spread evenly over window seconds,
+    smoothing the upstream load of a tick instead of sending every request
+    at the start of the slot. batch_size <= 0 or window <= 0 yields one batch.
+    """
+    items = list(items)
+    if batch_size <= 0 or window <= 0 or len(items) <= batch_size:
+        if items:
+            yield items
+        return
+
+    batches = [items[i:i + batch_size] for i in range(0, len(items), batch_size)]
+    step = window / len(batches)
+    started = time.monotonic()
+    for index, batch in enumerate(batches):
+        delay = started + index * step - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        yield batch
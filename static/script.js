@@ -1,6 +1,6 @@
 let chart;
 let updateInterval;
-let priceUpdateInterval; // Biến để lưu interval của updatePrice
+let priceSource; // EventSource nhận giá realtime từ /price_stream
 let symbol;
 
 function startChart(symbol) {
@@ -8,39 +8,29 @@ function startChart(symbol) {
     if (updateInterval) {
         clearInterval(updateInterval);
     }
-    if (priceUpdateInterval) {
-        clearInterval(priceUpdateInterval);
+    if (priceSource) {
+        priceSource.close();
     }
 
-    // Call updatePrice every second if symbol is valid
-    priceUpdateInterval = setInterval(() => updatePrice(symbol), 1000);
+    // Server đẩy giá mới mỗi giây, mọi tab dùng chung một poller cho mỗi symbol
+    priceSource = new EventSource(`/price_stream?symbol=${encodeURIComponent(symbol)}`);
+    priceSource.onmessage = (event) => updatePrice(JSON.parse(event.data));
 }
 
-async function updatePrice(symbol) {
-    try {
-        const response = await fetch('/get_current_price', {
-            method: 'POST',
-            headers: { 'Content-Type': 'application/json' },
-            body: JSON.stringify({ symbol })
-        });
-
-        const data = await response.json();
-        // console.log(data)
-        if (data.error) {
-            //alert(data.error); // Show error if symbol is invalid
-            clearInterval(priceUpdateInterval); // Stop further price updates
-            return;
-        }
+function updatePrice(data) {
+    // console.log(data)
+    if (data.error) {
+        //alert(data.error); // Show error if symbol is invalid
+        priceSource.close(); // Stop further price updates
+        return;
+    }
 
-        currentPrice = data.close; // Current price (latest closing price)
+    currentPrice = data.close; // Current price (latest closing price)
 
-        // Update price display
-        const lastUpdateTime = new Date().toLocaleTimeString();
-        document.getElementById('currentTime').innerHTML = `${lastUpdateTime}`;
-        document.getElementById('currentPrice').innerHTML = `<span >${currentPrice}</span>`;
-    } catch (error) {
-        console.error('Error updating price:', error);
-    }
+    // Update price display
+    const lastUpdateTime = new Date().toLocaleTimeString();
+    document.getElementById('currentTime').innerHTML = `${lastUpdateTime}`;
+    document.getElementById('currentPrice').innerHTML = `<span >${currentPrice}</span>`;
 }
 
 async function searchHistorical() {
@@ -63,16 +53,18 @@ async function searchHistorical() {
         const response = await fetch('/get_historical_data', {
             method: 'POST',
             headers: { 'Content-Type': 'application/json' },
-            body: JSON.stringify({ symbol, days })
+            body: JSON.stringify({ symbol, days, format: 'binary' })
         });
 
-        const data = await response.json();
-
-        if (data.error) {
+        // Lỗi vẫn trả về dạng JSON, dữ liệu nến trả về dạng nhị phân
+        const contentType = response.headers.get('Content-Type') || '';
+        if (contentType.includes('application/json')) {
+            const data = await response.json();
+            console.log(data);
             alert("Đã xảy ra lỗi trong quá trình lấy dữ liệu, vui lòng kiểm tra lại tên Symbol!");
         } else {
-            console.log(data);
-            displayHistoricalData(data);
+            const candles = decodeCandles(await response.arrayBuffer());
+            displayHistoricalData(candles);
         }
     } catch (error) {
         console.error('Error fetching historical data:', error);
@@ -86,23 +78,56 @@ async function searchHistorical() {
 
 
 
-function displayHistoricalData(data) {
+// Số cột float64 của mỗi nến trong định dạng nhị phân: [open_time, open, high, low, close, volume]
+const CANDLE_FIELDS = 6;
+
+function decodeCandles(buffer) {
+    const values = new Float64Array(buffer);
+    const count = values.length / CANDLE_FIELDS;
+    const candles = {
+        time: new Float64Array(count),
+        open: new Float64Array(count),
+        high: new Float64Array(count),
+        low: new Float64Array(count),
+        close: new Float64Array(count),
+        volume: new Float64Array(count)
+    };
+
+    for (let i = 0; i < count; i++) {
+        const base = i * CANDLE_FIELDS;
+        candles.time[i] = values[base];
+        candles.open[i] = values[base + 1];
+        candles.high[i] = values[base + 2];
+        candles.low[i] = values[base + 3];
+        candles.close[i] = values[base + 4];
+        candles.volume[i] = values[base + 5];
+    }
+    return candles;
+}
+
+function formatCandleTime(ms) {
+    // Định dạng 'dd.mm.yy - HH:MM' theo giờ UTC giống phía server
+    const date = new Date(ms);
+    const pad = (value) => String(value).padStart(2, '0');
+    return `${pad(date.getUTCDate())}.${pad(date.getUTCMonth() + 1)}.${String(date.getUTCFullYear()).slice(2)} - ${pad(date.getUTCHours())}:${pad(date.getUTCMinutes())}`;
+}
+
+function displayHistoricalData(candles) {
     const container = document.getElementById('historicalData');
     container.innerHTML = '';
 
-    // data.length -= 1;
     const columnsPerTable = window.innerWidth < 768 ? 1 : 3;
 
     // Nhóm dữ liệu theo ngày
     const groupedByDay = {};
-    data.forEach(record => {
-        const dateStr = record[0].split(" - ")[0];
-        const date = dateStr.split(" ")[0];
+    for (let i = 0; i < candles.time.length; i++) {
+        const time = formatCandleTime(candles.time[i]);
+        const date = time.split(" - ")[0];
         if (!groupedByDay[date]) {
             groupedByDay[date] = [];
         }
-        groupedByDay[date].push(record);
-    });
+        groupedByDay[date].push({ time, high: candles.high[i], low: candles.low[i] });
+    }
 
     const days = Object.keys(groupedByDay);
     const numberOfTables = Math.ceil(days.length / columnsPerTable);
@@ -202,11 +227,11 @@ function displayHistoricalData(data) {
 
                 // Data processing logic
                 const formattedDayData = dayData.map(record => ({
-                    time: record[0],
-                    highPrice: parseFloat(record[2]),
-                    lowPrice: parseFloat(record[3]),
-                    displayHigh: `${record[0]} : ${parseFloat(record[2]).toFixed(8)}`,
-                    displayLow: `${record[0]} : ${parseFloat(record[3]).toFixed(8)}`
+                    time: record.time,
+                    highPrice: record.high,
+                    lowPrice: record.low,
+                    displayHigh: `${record.time} : ${record.high.toFixed(8)}`,
+                    displayLow: `${record.time} : ${record.low.toFixed(8)}`
                 }));
 
                 let currentPriceMode = 'low';
@@ -328,7 +353,7 @@ window.onbeforeunload = function() {
     if (updateInterval) {
         clearInterval(updateInterval);
     }
-    if (priceUpdateInterval) {
-        clearInterval(priceUpdateInterval);
+    if (priceSource) {
+        priceSource.close();
     }
 };
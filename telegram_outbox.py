@@ -0,0 +1,167 @@
+import heapq
+import threading
+import time
+from collections import deque
+from telebot import types
+from telebot.apihelper import ApiTelegramException
+import metrics
+
+TELEGRAM_MAX_LENGTH = 4096
+
+SEND_LATENCY = metrics.histogram('telegram_send_duration_seconds', 'Telegram sendMessage latency', ('result',))
+QUEUE_DELAY = metrics.histogram('telegram_queue_delay_seconds', 'Time a message waited in the outbox before sending')
+
+def split_long_message(message, max_length=TELEGRAM_MAX_LENGTH):
+    """
+    Split a long message into multiple messages of specified max length.
+    Telegram has a 4096 character limit per message.
+    """
+    messages = []
+    while message:
+        # If message is shorter than max length, add it and break
+        if len(message) <= max_length:
+            messages.append(message)
+            break
+
+        # Try to split at a newline close to max length
+        split_index = message.rfind('\n', 0, max_length)
+
+        # If no newline found, just cut at max length
+        if split_index == -1:
+            split_index = max_length
+
+        # Add the first part to messages
+        messages.append(message[:split_index])
+
+        # Remove the first part from the message
+        message = message[split_index:].lstrip()
+
+    return messages
+
+class _Chat:
+    __slots__ = ('pending', 'ready_at', 'scheduled')
+
+    def __init__(self):
+        self.pending = deque()  # (text, parse_mode, reply_to_message_id, enqueued_at)
+        self.ready_at = 0.0
+        self.scheduled = False  # đang nằm trong heap hoặc đang được gửi
+
+class TelegramOutbox:
+    """
+    Non-blocking outbound queue for Telegram messages with one sender thread.
+    Sends are spaced per chat (chat_interval) and globally (global_rate per
+    second); queued messages for the same chat are coalesced up to the
+    4096-char limit, and a 429 re-queues the batch after retry_after.
+    """
+
+    def __init__(self, bot, chat_interval=1.0, global_rate=25.0, max_attempts=3):
+        self.bot = bot
+        self.chat_interval = chat_interval
+        self.global_interval = 1.0 / global_rate
+        self.max_attempts = max_attempts
+        self._chats = {}
+        self._heap = []  # (ready_at, seq, chat_id) của các chat có tin chờ gửi
+        self._seq = 0
+        self._next_global_at = 0.0
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def send(self, chat_id, text, parse_mode=None, reply_to_message_id=None):
+        # Không bao giờ chặn luồng gọi: chỉ xếp hàng rồi trả về ngay
+        if chat_id is None or not text:
+            return
+        with self._cond:
+            chat = self._chats.get(chat_id)
+            if chat is None:
+                chat = self._chats[chat_id] = _Chat()
+            for part in split_long_message(text):
+                chat.pending.append((part, parse_mode, reply_to_message_id, time.monotonic()))
+            if not chat.scheduled:
+                self._schedule(chat_id, chat, max(chat.ready_at, time.monotonic()))
+            self._cond.notify()
+
+    def reply_to(self, message, text, parse_mode=None):
+        self.send(message.chat.id, text, parse_mode=parse_mode, reply_to_message_id=message.message_id)
+
+    def pending(self):
+        with self._cond:
+            return sum(len(chat.pending) for chat in self._chats.values())
+
+    def _schedule(self, chat_id, chat, ready_at):
+        chat.scheduled = True
+        self._seq += 1
+        heapq.heappush(self._heap, (ready_at, self._seq, chat_id))
+
+    def _take_batch(self, pending):
+        # Gộp các tin liên tiếp cùng parse_mode và cùng tin được trả lời, tối đa 4096 ký tự
+        text, parse_mode, reply_to, enqueued_at = pending.popleft()
+        while pending:
+            next_text, next_parse_mode, next_reply_to, _ = pending[0]
+            if (next_parse_mode, next_reply_to) != (parse_mode, reply_to):
+                break
+            if len(text) + 2 + len(next_text) > TELEGRAM_MAX_LENGTH:
+                break
+            text += '\n\n' + next_text
+            pending.popleft()
+        return text, parse_mode, reply_to, enqueued_at
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while True:
+                    now = time.monotonic()
+                    if self._heap:
+                        ready_at = max(self._heap[0][0], self._next_global_at)
+                        if ready_at <= now:
+                            break
+                        self._cond.wait(ready_at - now)
+                    else:
+                        self._cond.wait()
+                _, _, chat_id = heapq.heappop(self._heap)
+                chat = self._chats[chat_id]
+                batch = self._take_batch(chat.pending)
+                self._next_global_at = now + self.global_interval
+
+            retry_after = self._deliver(chat_id, batch)
+
+            with self._cond:
+                now = time.monotonic()
+                if retry_after is not None:
+                    # Bị 429: đưa lại lên đầu hàng đợi của chat và chờ đúng retry_after
+                    chat.pending.appendleft(batch)
+                    chat.ready_at = now + max(retry_after, self.chat_interval)
+                else:
+                    chat.ready_at = now + self.chat_interval
+                if chat.pending:
+                    self._schedule(chat_id, chat, chat.ready_at)
+                else:
+                    chat.scheduled = False
+
+    def _deliver(self, chat_id, batch):
+        # Trả về retry_after (giây) nếu bị Telegram giới hạn, None nếu đã gửi xong hoặc bỏ qua
+        text, parse_mode, reply_to, enqueued_at = batch
+        QUEUE_DELAY.observe(time.monotonic() - enqueued_at)
+        reply_parameters = None
+        if reply_to is not None:
+            reply_parameters = types.ReplyParameters(reply_to, allow_sending_without_reply=True)
+
+        for attempt in range(1, self.max_attempts + 1):
+            started = time.perf_counter()
+            try:
+                self.bot.send_message(chat_id, text, parse_mode=parse_mode, reply_parameters=reply_parameters)
+                SEND_LATENCY.observe(time.perf_counter() - started, result='ok')
+                return None
+            except ApiTelegramException as e:
+                SEND_LATENCY.observe(time.perf_counter() - started, result='rate_limited' if e.error_code == 429 else 'error')
+                if e.error_code == 429:
+                    parameters = (e.result_json or {}).get('parameters') or {}
+                    return float(parameters.get('retry_after', 1))
+                print(f"Lỗi gửi tin nhắn Telegram tới {chat_id}: {e}")
+                return None
+            except Exception as e:
+                SEND_LATENCY.observe(time.perf_counter() - started, result='error')
+                print(f"Lỗi gửi tin nhắn Telegram tới {chat_id} (lần {attempt}): {e}")
+                if attempt < self.max_attempts:
+                    time.sleep(2 ** (attempt - 1))
+        return None
@@ -0,0 +1,136 @@
+import threading
+import time
+from collections import OrderedDict
+
+class _Call:
+    def __init__(self):
+        self.event = threading.Event()
+        self.value = None
+        self.error = None
+
+class TTLCache:
+    """
+    Thread-safe TTL cache with LRU eviction and single-flight loading:
+    concurrent misses for the same key wait for one loader call instead of
+    each going upstream. Loader exceptions are shared but not cached.
+    """
+
+    def __init__(self, max_size=1024):
+        self.max_size = max_size
+        self._data = OrderedDict()  # key -> (expires_at, value)
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    def get_or_load(self, key, loader, ttl):
+        # ttl: số giây, hoặc hàm trả về số giây (tính tại thời điểm lưu)
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self._data.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+
+            call = self._inflight.get(key)
+            is_leader = call is None
+            if is_leader:
+                call = self._inflight[key] = _Call()
+                self.misses += 1
+            else:
+                self.coalesced += 1
+
+        if not is_leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.value
+
+        try:
+            call.value = loader()
+            seconds = ttl() if callable(ttl) else ttl
+            with self._lock:
+                self._data[key] = (time.monotonic() + seconds, call.value)
+                self._data.move_to_end(key)
+                while len(self._data) > self.max_size:
+                    self._data.popitem(last=False)
+            return call.value
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            call.event.set()
+
+    def get_or_load_many(self, keys, loader, ttl):
+        """
+        Batch form of get_or_load: loader(missing_keys) must return a dict
+        with a value for every key it was given, so all the misses cost one
+        upstream call. Keys already being loaded by another caller are waited
+        for instead. Returns {key: value} in the order of keys.
+        """
+        keys = list(dict.fromkeys(keys))
+        values = {}
+        leading = {}  # key -> _Call do lời gọi này nạp
+        waiting = {}  # key -> _Call của lời gọi khác đang nạp
+        with self._lock:
+            now = time.monotonic()
+            for key in keys:
+                entry = self._data.get(key)
+                if entry is not None and entry[0] > now:
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    values[key] = entry[1]
+                elif key in self._inflight:
+                    self.coalesced += 1
+                    waiting[key] = self._inflight[key]
+                else:
+                    self.misses += 1
+                    leading[key] = self._inflight[key] = _Call()
+
+        if leading:
+            try:
+                loaded = loader(list(leading))
+                seconds = ttl() if callable(ttl) else ttl
+                with self._lock:
+                    expires_at = time.monotonic() + seconds
+                    for key, call in leading.items():
+                        call.value = values[key] = loaded[key]
+                        self._data[key] = (expires_at, call.value)
+                        self._data.move_to_end(key)
+                    while len(self._data) > self.max_size:
+                        self._data.popitem(last=False)
+            except Exception as e:
+                for call in leading.values():
+                    call.error = e
+                raise
+            finally:
+                with self._lock:
+                    for key in leading:
+                        self._inflight.pop(key, None)
+                for call in leading.values():
+                    call.event.set()
+
+        for key, call in waiting.items():
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            values[key] = call.value
+
+        return {key: values[key] for key in keys}
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses + self.coalesced
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'coalesced': self.coalesced,
+                'size': len(self._data),
+                'hit_ratio': (self.hits + self.coalesced) / lookups if lookups else 0.0
+            }
+
+def seconds_to_next_minute():
+    return 60 - (time.time() % 60)
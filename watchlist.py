@@ -0,0 +1,102 @@
+import os
+import threading
+from atomic_file import atomic_write
+
+class Watchlist:
+    """
+    Ordered, in-memory set of watched symbols backed by a text file.
+    The file is re-read only when its mtime/size changes and is written only
+    when the list is mutated. on_change(symbols) runs after every change,
+    including edits made to the file by hand.
+    """
+
+    def __init__(self, path, on_change=None):
+        self.path = path
+        self.on_change = on_change
+        self._symbols = {}  # dict giữ thứ tự thêm vào, tra cứu O(1)
+        self._signature = None
+        self._lock = threading.Lock()
+
+    def _file_signature(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def _reload_if_changed(self):
+        # Gọi khi đang giữ self._lock; trả về True nếu danh sách thay đổi
+        signature = self._file_signature()
+        if signature == self._signature:
+            return False
+
+        symbols = {}
+        if signature is not None:
+            with open(self.path, 'r') as f:
+                # Lọc bỏ các dòng trống và chuẩn hóa dữ liệu
+                for line in f:
+                    symbol = line.strip().upper()
+                    if symbol:
+                        symbols[symbol] = None
+
+        self._signature = signature
+        changed = list(symbols) != list(self._symbols)
+        self._symbols = symbols
+        return changed
+
+    def _persist(self):
+        atomic_write(self.path, ''.join(f"{symbol}\n" for symbol in self._symbols), prefix='.checklist-')
+        self._signature = self._file_signature()
+
+    def _notify(self, symbols):
+        if self.on_change is not None:
+            self.on_change(symbols)
+
+    def symbols(self):
+        with self._lock:
+            changed = self._reload_if_changed()
+            symbols = list(self._symbols)
+        if changed:
+            self._notify(symbols)
+        return symbols
+
+    def __contains__(self, symbol):
+        with self._lock:
+            self._reload_if_changed()
+            return symbol.upper() in self._symbols
+
+    def add(self, symbols):
+        # Trả về (các coin mới thêm, các coin đã có sẵn)
+        added, existing = [], []
+        with self._lock:
+            self._reload_if_changed()
+            for symbol in symbols:
+                symbol = symbol.upper()
+                if symbol in self._symbols:
+                    existing.append(symbol)
+                else:
+                    self._symbols[symbol] = None
+                    added.append(symbol)
+            if added:
+                self._persist()
+            current = list(self._symbols)
+        if added:
+            self._notify(current)
+        return added, existing
+
+    def remove(self, symbols):
+        # Trả về các coin thực sự bị xóa
+        removed = []
+        with self._lock:
+            self._reload_if_changed()
+            for symbol in symbols:
+                symbol = symbol.upper()
+                if symbol in self._symbols:
+                    del self._symbols[symbol]
+                    removed.append(symbol)
+            if removed:
+                self._persist()
+            current = list(self._symbols)
+        if removed:
+            self._notify(current)
+        return removed